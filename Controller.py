@@ -20,9 +20,11 @@
 # management, and a facility for accessing application settings
 # Options:
 # model, name, view
+import os
 from warnings import warn
 from .core.OptionsMixin import OptionsMixin
 from .core import fileIO
+from .core.FileWatcher import FileWatcher
 
 
 class Controller(OptionsMixin):
@@ -33,6 +35,8 @@ class Controller(OptionsMixin):
         self._view = None
         self._viewActive = False
         self.widgets = dict()
+        self._watcher = None
+        self._watchedPaths = dict()
         self.setModel(self.option("model"))
         self.setView(self.option("view"))
 
@@ -82,8 +86,48 @@ class Controller(OptionsMixin):
         if widget.name() in self.widgets:
             self.widgets.pop(widget.name())
 
+    # This method watches a file or directory for changes, and resets the given
+    # widgets (widget objects or names) when it changes. Changes are detected
+    # by a FileWatcher using the view's Tk interpreter, so the view must be
+    # set first.
+    def watchPath(self, path, widgets=()):
+        if self._watcher is None:
+            if self.view() is None:
+                warn("No view to watch paths with", RuntimeWarning)
+                return
+            self._watcher = FileWatcher(self.view(), self.pathsChanged)
+        names = self._watchedPaths.setdefault(os.path.abspath(path), set())
+        names.update(widget if isinstance(widget, str) else widget.name()
+                     for widget in widgets)
+        self._watcher.watch(path)
+
+    # This method stops watching a path for the given widgets, or for all
+    # widgets if none are given.
+    def unwatchPath(self, path, widgets=None):
+        path = os.path.abspath(path)
+        names = self._watchedPaths.get(path)
+        if names is None:
+            return
+        if widgets is not None:
+            names.difference_update(widget if isinstance(widget, str) else
+                                    widget.name() for widget in widgets)
+        if widgets is None or not names:
+            self._watchedPaths.pop(path)
+            self._watcher.unwatch(path)
+
     # Methods to be overridden by subclasses:
 
+    # This method is called on the Tk thread with the set of watched paths
+    # that changed. By default, it resets each widget watching those paths
+    # once.
+    def pathsChanged(self, paths):
+        names = set()
+        for path in paths:
+            names.update(self._watchedPaths.get(path, ()))
+        for name in names:
+            if name in self.widgets:
+                self.widgets[name].reset()
+
     # This method should be used to handle any setup that should only occur
     # after the view has been fully created. It should be called by the view
     # once setup is complete.
@@ -112,12 +156,18 @@ class Controller(OptionsMixin):
                 return fileIO.listDirectory(**kwargs)
             case "latestFile":
                 return fileIO.latestFile(**kwargs)
+            case "newestFiles":
+                return fileIO.newestFiles(**kwargs)
             case "readFile":
                 return fileIO.readFile(**kwargs)
             case "readJSON":
                 return fileIO.readJSON(**kwargs)
             case "readCSV":
                 return fileIO.readCSV(**kwargs)
+            case "readCSVRows":
+                return fileIO.readCSVRows(**kwargs)
+            case "csvRowCount":
+                return fileIO.csvRowCount(**kwargs)
         return None
 
     # This method should be called by the model when something internal to the
@@ -129,9 +179,11 @@ class Controller(OptionsMixin):
             case "deleteDir":
                 fileIO.deleteDirectory(**kwargs)
             case "copyDir":
-                fileIO.copyDirectory(**kwargs)
+                return fileIO.copyDirectory(**kwargs)
+            case "syncDir":
+                return fileIO.syncDirectory(**kwargs)
             case "copyFile":
-                fileIO.copyFile(**kwargs)
+                return fileIO.copyFile(**kwargs)
             case "moveFile":
                 fileIO.moveFile(**kwargs)
             case "deleteFile":
@@ -142,8 +194,12 @@ class Controller(OptionsMixin):
                 fileIO.writeJSON(**kwargs)
             case "writeCSV":
                 fileIO.writeCSV(**kwargs)
+            case "openJSONL":
+                return fileIO.openJSONL(**kwargs)
             case "shellCmd":
                 return fileIO.shellCmd(**kwargs)
+            case "shellCmdBatch":
+                return fileIO.shellCmdBatch(**kwargs)
 
     # This method should be called by the model when the user should be
     # notified about something related to the model that isn't necessarily
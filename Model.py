@@ -72,17 +72,22 @@ class Model(OptionsMixin):
     def _currentDir(self):
         return self._dataForModel("currentDir")
 
-    def _pathExists(self, path):
-        return self._dataForModel("pathExists", path=path)
+    def _pathExists(self, path, **kwargs):
+        return self._dataForModel("pathExists", path=path, **kwargs)
 
-    def _listDir(self, directory, listFiles=True, listDirectories=True):
+    def _listDir(self, directory, listFiles=True, listDirectories=True,
+                 **kwargs):
         return self._dataForModel("listDir", directory=directory,
                                   listFiles=listFiles,
-                                  listDirectories=listDirectories)
+                                  listDirectories=listDirectories, **kwargs)
 
-    def _latestFile(self, directory, extension=""):
+    def _latestFile(self, directory, extension="", **kwargs):
         return self._dataForModel("latestFile", directory=directory,
-                                  extension=extension)
+                                  extension=extension, **kwargs)
+
+    def _newestFiles(self, directory, k, extension="", **kwargs):
+        return self._dataForModel("newestFiles", directory=directory, k=k,
+                                  extension=extension, **kwargs)
 
     def _readFile(self, file, **kwargs):
         return self._dataForModel("readFile", file=file, **kwargs)
@@ -93,18 +98,31 @@ class Model(OptionsMixin):
     def _readCSV(self, file, **kwargs):
         return self._dataForModel("readCSV", file=file, **kwargs)
 
+    def _readCSVRows(self, file, start, count=1, **kwargs):
+        return self._dataForModel("readCSVRows", file=file, start=start,
+                                  count=count, **kwargs)
+
+    def _csvRowCount(self, file, **kwargs):
+        return self._dataForModel("csvRowCount", file=file, **kwargs)
+
     def _createDir(self, directory):
         self._modelUpdated("createDir", directory=directory)
 
     def _deleteDir(self, directory):
         self._modelUpdated("deleteDir", directory=directory)
 
-    def _copyDir(self, source, destination, existOK=False):
-        self._modelUpdated("copyDir", source=source,
-                           destination=destination, existOK=existOK)
+    def _copyDir(self, source, destination, existOK=False, **kwargs):
+        return self._modelUpdated("copyDir", source=source,
+                                  destination=destination, existOK=existOK,
+                                  **kwargs)
 
-    def _copyFile(self, source, destination):
-        self._modelUpdated("copyFile", source=source, destination=destination)
+    def _syncDir(self, source, destination, **kwargs):
+        return self._modelUpdated("syncDir", source=source,
+                                  destination=destination, **kwargs)
+
+    def _copyFile(self, source, destination, **kwargs):
+        return self._modelUpdated("copyFile", source=source,
+                                  destination=destination, **kwargs)
 
     def _moveFile(self, source, destination):
         self._modelUpdated("moveFile", source=source, destination=destination)
@@ -121,9 +139,16 @@ class Model(OptionsMixin):
     def _writeCSV(self, data, file, **kwargs):
         self._modelUpdated("writeCSV", data=data, file=file, **kwargs)
 
+    def _openJSONL(self, file, **kwargs):
+        return self._modelUpdated("openJSONL", file=file, **kwargs)
+
     def _shellCmd(self, command, **kwargs):
         return self._modelUpdated("shellCmd", command=command, **kwargs)
 
+    def _shellCmdBatch(self, commands, **kwargs):
+        return self._modelUpdated("shellCmdBatch", commands=commands,
+                                  **kwargs)
+
     # Methods to be overridden by subclasses:
 
     # This method should return a model value for the given key to the
@@ -0,0 +1,228 @@
+# Copyright (c) 2023 The Old Man and the C
+#
+# This file is part of mvcTkinter.
+#
+# mvcTkinter is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# mvcTkinter is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU Affero General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Affero General Public License along
+# with mvcTkinter. If not, see <https://www.gnu.org/licenses/>.
+
+# CSVTable class
+# Holds CSV data by column instead of by row. Numeric columns are stored as
+# typed arrays (NumPy arrays if NumPy is installed, otherwise array.array), and
+# string columns are stored as arrays of indexes into one string store shared
+# by every column, so repeated strings are only kept once.
+# Column types are given by dtypes, a dictionary keyed by header name or column
+# index, with values that are array module type codes ("d", "q", etc.), int,
+# float, or str. Columns without a type are string columns. Empty cells in
+# numeric columns are read as nan for floating point columns and 0 for integer
+# columns. Rows shorter than the header row are padded with empty cells, and
+# cells past the end of the header row are ignored.
+# The header row is not part of the table data, so row 0 is the first row after
+# the header row.
+
+from array import array
+from .fileIO import _uniqueKey
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+STRING = "str"
+
+typeCodes = {
+    int: "q",
+    float: "d",
+    str: STRING,
+}
+
+floatTypeCodes = "fd"
+
+
+class CSVTable:
+    def __init__(self, headers, indexRow=0, dtypes=None):
+        self._headers = list(headers)
+        self._indexRow = indexRow
+        self._strings = []
+        self._stringIDs = dict()
+        self._typeCodes = []
+        self._columns = []
+        self._length = 0
+        self._keys = None
+        self._headerNames = None
+        dtypes = dtypes or dict()
+        for index, header in enumerate(self._headers):
+            dtype = dtypes.get(header, dtypes.get(index, STRING))
+            typeCode = typeCodes.get(dtype, dtype)
+            self._typeCodes.append(typeCode)
+            self._columns.append(array("I" if typeCode == STRING else
+                                       typeCode))
+
+    # This method creates a table from an iterable of rows, using the first row
+    # as the header row. Returns None if there are no rows.
+    @classmethod
+    def fromRows(cls, rows, indexRow=0, dtypes=None):
+        rows = iter(rows)
+        headers = next(rows, None)
+        if headers is None:
+            return None
+        table = cls(headers, indexRow, dtypes)
+        for row in rows:
+            table._appendRow(row)
+        table._finish()
+        return table
+
+    def _appendRow(self, row):
+        for index, column in enumerate(self._columns):
+            cell = row[index] if index < len(row) else ""
+            typeCode = self._typeCodes[index]
+            if typeCode == STRING:
+                stringID = self._stringIDs.get(cell)
+                if stringID is None:
+                    stringID = len(self._strings)
+                    self._stringIDs[cell] = stringID
+                    self._strings.append(cell)
+                column.append(stringID)
+            elif not cell:
+                column.append(float("nan") if typeCode in floatTypeCodes
+                              else 0)
+            elif typeCode in floatTypeCodes:
+                column.append(float(cell))
+            else:
+                column.append(int(cell))
+        self._length += 1
+
+    # Once all rows are added, numeric columns are wrapped as read only NumPy
+    # arrays without copying them, so tables can be shared (as cached readCSV
+    # results are), and the string lookup dictionary is dropped since only the
+    # string store is needed from then on.
+    def _finish(self):
+        self._stringIDs = None
+        if numpy is None:
+            return
+        for index, column in enumerate(self._columns):
+            if self._typeCodes[index] != STRING:
+                column = numpy.frombuffer(column, dtype=column.typecode)
+                column.flags.writeable = False
+                self._columns[index] = column
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        return self.row(index)
+
+    def __iter__(self):
+        for index in range(self._length):
+            yield self.row(index)
+
+    # This method returns the header row.
+    def headers(self):
+        return list(self._headers)
+
+    # This method returns the type code of the column for the given header
+    # name or column index.
+    def columnType(self, key):
+        return self._typeCodes[self._columnIndex(key)]
+
+    # This method returns the values of a column for the given header name or
+    # column index. Numeric columns are returned as the stored NumPy array
+    # itself, which is read only, or without NumPy as a copy of the stored
+    # array.array. String columns are returned as a new list of strings.
+    def column(self, key):
+        index = self._columnIndex(key)
+        column = self._columns[index]
+        if self._typeCodes[index] == STRING:
+            strings = self._strings
+            return [strings[stringID] for stringID in column]
+        if isinstance(column, array):
+            return array(column.typecode, column)
+        return column
+
+    # This method returns the row at the given index as a list of values.
+    def row(self, index):
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("CSVTable row index out of range")
+        return [self._cell(column, index) for column in
+                range(len(self._columns))]
+
+    # This method returns the row at the given index as a dictionary keyed by
+    # header names, with the same duplicate header rules as readCSV.
+    def rowDict(self, index):
+        if self._headerNames is None:
+            usedHeaders = set()
+            counters = dict()
+            self._headerNames = [_uniqueKey(header, usedHeaders, counters)
+                                 for header in self._headers]
+        return dict(zip(self._headerNames, self.row(index)))
+
+    # This method returns the row for the given indexRow key, or None if there
+    # isn't one. Keys follow the same duplicate key rules as
+    # readCSV(useDict=True), so the header row key is reserved. For a numeric
+    # index column, the keys are the str() of the stored values.
+    def rowForKey(self, key):
+        if self._keys is None:
+            self._buildKeyIndex()
+        index = self._keys.get(key)
+        if index is None:
+            return None
+        return self.row(index)
+
+    def _buildKeyIndex(self):
+        usedKeys = set()
+        counters = dict()
+        self._keys = dict()
+        _uniqueKey(self._headers[self._indexRow], usedKeys, counters)
+        for index in range(self._length):
+            key = str(self._cell(self._indexRow, index))
+            self._keys[_uniqueKey(key, usedKeys, counters)] = index
+
+    # This method returns the sum of a numeric column.
+    def sum(self, key):
+        column = self._columns[self._columnIndex(key)]
+        if numpy is not None:
+            return column.sum().item()
+        return sum(column)
+
+    # This method returns the row indexes in the order that sorts the given
+    # column. The sort is stable.
+    def sortOrder(self, key, reverse=False):
+        index = self._columnIndex(key)
+        column = self._columns[index]
+        if self._typeCodes[index] == STRING:
+            strings = self._strings
+            return sorted(range(self._length),
+                          key=lambda row: strings[column[row]],
+                          reverse=reverse)
+        if numpy is not None:
+            if not reverse:
+                return numpy.argsort(column, kind="stable").tolist()
+            # sort the reversed column so equal values keep their order
+            order = numpy.argsort(column[::-1], kind="stable")[::-1]
+            return (self._length - 1 - order).tolist()
+        return sorted(range(self._length), key=column.__getitem__,
+                      reverse=reverse)
+
+    def _columnIndex(self, key):
+        if isinstance(key, int):
+            return key
+        return self._headers.index(key)
+
+    def _cell(self, column, index):
+        value = self._columns[column][index]
+        if self._typeCodes[column] == STRING:
+            return self._strings[value]
+        if numpy is not None:
+            return value.item()
+        return value
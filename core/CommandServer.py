@@ -0,0 +1,137 @@
+# Copyright (c) 2023 The Old Man and the C
+#
+# This file is part of mvcTkinter.
+#
+# mvcTkinter is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# mvcTkinter is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU Affero General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Affero General Public License along
+# with mvcTkinter. If not, see <https://www.gnu.org/licenses/>.
+
+# CommandServer class
+# Runs shell commands through a long-lived POSIX shell process, so each command
+# doesn't pay for starting a new process from the application. Commands are
+# split and quoted the same way shellCmd splits them, and sent over the shell's
+# stdin to be run with exec in a subshell with stdin redirected from /dev/null,
+# so, as with shellCmd, the program is run directly and nothing a command does
+# changes the shell for later commands. Shell builtins and keywords like cd or
+# if aren't programs, so they fail with return code 127. Each command's stdout
+# and stderr are collected until a marker line with the return code, giving
+# the same (returncode, output) result as shellCmd(output=False). Commands run
+# one at a time. If the shell exits or a command times out, the shell is
+# replaced on the next command.
+
+import io
+import locale
+import os
+import selectors
+import shlex
+import subprocess
+import threading
+import time
+import uuid
+
+
+class CommandServer:
+    def __init__(self, shell="/bin/sh", cwd=None, env=None, encoding=None):
+        self._shell = shell
+        self._cwd = cwd
+        self._env = env
+        self._encoding = encoding or locale.getpreferredencoding(False)
+        self._marker = uuid.uuid4().hex.encode("ascii")
+        self._process = None
+        self._lock = threading.Lock()
+        self.restarts = 0
+
+    # This method runs a command and returns (returncode, output). If text is
+    # set, the output is decoded with universal newlines like shellCmd does.
+    # If the command runs longer than timeout seconds, the shell is killed and
+    # the return code is None, as is it if the shell exits during the command.
+    def run(self, command, text=True, timeout=None):
+        line = "( exec {} ) </dev/null 2>&1; printf '\\n%s %d\\n' {} $?\n" \
+            .format(shlex.join(shlex.split(command)),
+                    self._marker.decode("ascii"))
+        with self._lock:
+            try:
+                self._send(line)
+            except OSError:
+                # the shell died since the last command
+                self._stop()
+                self._send(line)
+            returnCode, output = self._receive(timeout)
+        if text:
+            output = io.IncrementalNewlineDecoder(None, translate=True) \
+                .decode(output.decode(self._encoding), final=True)
+        return returnCode, output
+
+    # This method stops the shell process.
+    def close(self):
+        with self._lock:
+            self._stop()
+
+    def _send(self, line):
+        if self._process is None or self._process.poll() is not None:
+            self._start()
+        self._process.stdin.write(line.encode(self._encoding))
+        self._process.stdin.flush()
+
+    def _start(self):
+        if self._process is not None:
+            self._stop()
+            self.restarts += 1
+        self._process = subprocess.Popen(
+            [self._shell], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT, cwd=self._cwd, env=self._env,
+            bufsize=0)
+
+    def _stop(self):
+        if self._process is None:
+            return
+        try:
+            self._process.stdin.close()
+        except OSError:
+            pass
+        if self._process.poll() is None:
+            self._process.kill()
+        self._process.wait()
+        self._process.stdout.close()
+
+    # Read output until the marker line, which follows a newline added before
+    # it, so the output is everything before that newline.
+    def _receive(self, timeout):
+        token = b"\n" + self._marker + b" "
+        output = bytearray()
+        searchStart = 0
+        deadline = None if timeout is None else time.monotonic() + timeout
+        pipe = self._process.stdout.fileno()
+        with selectors.DefaultSelector() as selector:
+            selector.register(pipe, selectors.EVENT_READ)
+            while True:
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                if (remaining is not None and remaining <= 0) or \
+                        not selector.select(remaining):
+                    self._stop()
+                    return None, bytes(output)
+                data = os.read(pipe, 65536)
+                if not data:
+                    self._stop()
+                    return None, bytes(output)
+                output += data
+                index = output.find(token, searchStart)
+                if index < 0:
+                    searchStart = max(0, len(output) - len(token) + 1)
+                    continue
+                searchStart = index
+                end = output.find(b"\n", index + len(token))
+                if end >= 0:
+                    returnCode = int(output[index + len(token):end])
+                    return returnCode, bytes(output[:index])
@@ -0,0 +1,348 @@
+# Copyright (c) 2023 The Old Man and the C
+#
+# This file is part of mvcTkinter.
+#
+# mvcTkinter is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# mvcTkinter is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU Affero General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Affero General Public License along
+# with mvcTkinter. If not, see <https://www.gnu.org/licenses/>.
+
+# DirectoryIndex class
+# Keeps an index of a directory tree (paths, sizes, mtimes, ctimes and
+# extensions) in an SQLite database file, so the tree can be queried without
+# scanning it. The index is built in a background thread when it is created,
+# and ready() returns True once it has been refreshed at least once. Until
+# then, queries answer from whatever is in the index file, which may be from
+# an earlier run.
+# refresh() only stats each directory, and only rescans the directories whose
+# mtime changed. Writing to an existing file doesn't change its directory's
+# mtime, so the sizes and mtimes of files changed in place are only updated by
+# refresh(full=True). If refreshInterval is set, the index is refreshed that
+# many seconds after each refresh by a background thread.
+# Symbolic links are indexed as what they point to, but links to directories
+# aren't followed, like iterDirectory. Entries that can't be read are skipped.
+# The fileIO functions listDirectory, latestFile, newestFiles and pathExists
+# take an index argument to answer from a ready index for paths under its
+# root.
+# Unless indexFile is given, the index file is kept in a mvcTkinter directory
+# in the user's cache directory, which only the user can access, so other
+# users can't plant or change the index that answers those functions.
+
+import fnmatch
+import hashlib
+import os
+import sqlite3
+import sys
+import threading
+import time
+from .fileIO import directoryCacheSettle
+
+schema = """
+CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS directories (path TEXT PRIMARY KEY,
+                                        mtime INTEGER);
+CREATE TABLE IF NOT EXISTS entries (path TEXT PRIMARY KEY, directory TEXT,
+                                    name TEXT, extension TEXT, size INTEGER,
+                                    mtime INTEGER, ctime INTEGER,
+                                    isFile INTEGER, isDir INTEGER,
+                                    isLink INTEGER);
+CREATE INDEX IF NOT EXISTS entriesDirectory ON entries (directory);
+CREATE INDEX IF NOT EXISTS entriesExtension ON entries (extension);
+CREATE INDEX IF NOT EXISTS entriesMtime ON entries (mtime);
+CREATE INDEX IF NOT EXISTS entriesCtime ON entries (ctime);
+"""
+
+
+# Return the per-user directory default index files are kept in, creating it
+# if needed. It must belong to the user, and access by anyone else is removed.
+def _indexDirectory():
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or \
+            os.path.join(os.path.expanduser("~"), ".cache")
+    directory = os.path.join(base, "mvcTkinter")
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    if sys.platform != "win32":
+        stat = os.stat(directory)
+        if stat.st_uid != os.getuid():
+            raise PermissionError("{} belongs to another user".format(
+                directory))
+        if stat.st_mode & 0o077:
+            os.chmod(directory, 0o700)
+    return directory
+
+
+class DirectoryIndex:
+    def __init__(self, root, indexFile=None, refreshInterval=None,
+                 build=True):
+        self._root = os.path.abspath(root)
+        if indexFile is None:
+            indexFile = os.path.join(_indexDirectory(),
+                                     "mvcTkinterIndex-{}.sqlite".format(
+                                         hashlib.sha1(os.fsencode(
+                                             self._root)).hexdigest()[:16]))
+        self._indexFile = indexFile
+        self._refreshInterval = refreshInterval
+        self._lock = threading.RLock()
+        self._refreshLock = threading.Lock()
+        self._ready = threading.Event()
+        self._closed = threading.Event()
+        self._thread = None
+        self._db = sqlite3.connect(indexFile, check_same_thread=False)
+        self._db.create_function("fnmatch", 2, fnmatch.fnmatch,
+                                 deterministic=True)
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode = WAL")
+            self._db.execute("PRAGMA synchronous = NORMAL")
+            self._db.executescript(schema)
+            row = self._db.execute("SELECT value FROM info WHERE key = 'root'"
+                                   ).fetchone()
+            if row is None or row[0] != self._root:
+                self._db.execute("DELETE FROM directories")
+                self._db.execute("DELETE FROM entries")
+                self._db.execute("INSERT OR REPLACE INTO info VALUES "
+                                 "('root', ?)", (self._root,))
+        if build or refreshInterval is not None:
+            self._thread = threading.Thread(target=self._refreshLoop,
+                                            daemon=True)
+            self._thread.start()
+
+    # This method returns the root directory of the index.
+    def root(self):
+        return self._root
+
+    # This method returns the path of the index file.
+    def indexFile(self):
+        return self._indexFile
+
+    # This method returns True once the index has been refreshed.
+    def ready(self):
+        return self._ready.is_set()
+
+    # This method waits until the index is ready or timeout seconds have
+    # passed, and returns True if it is ready.
+    def wait(self, timeout=None):
+        return self._ready.wait(timeout)
+
+    # This method returns True if the path is the root or under it.
+    def contains(self, path):
+        path = os.path.abspath(path)
+        return path == self._root or \
+            path.startswith(os.path.join(self._root, ""))
+
+    # This method stops the refresh thread and closes the index file.
+    def close(self):
+        self._closed.set()
+        if self._thread is not None:
+            self._thread.join()
+        with self._lock:
+            self._db.close()
+
+    # This method brings the index up to date. Only directories whose mtime
+    # changed are rescanned, unless full is set.
+    def refresh(self, full=False):
+        with self._refreshLock:
+            directories = [self._root]
+            while directories and not self._closed.is_set():
+                directories.extend(self._refreshDirectory(directories.pop(),
+                                                          full))
+        self._ready.set()
+
+    def _refreshLoop(self):
+        self.refresh()
+        while self._refreshInterval is not None and \
+                not self._closed.wait(self._refreshInterval):
+            self.refresh()
+
+    # Rescan a directory if it changed, and return its subdirectories
+    def _refreshDirectory(self, directory, full):
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+        except OSError:
+            with self._lock, self._db:
+                self._deleteTree(directory)
+            return []
+        with self._lock:
+            row = self._db.execute("SELECT mtime FROM directories WHERE "
+                                   "path = ?", (directory,)).fetchone()
+            if not full and row is not None and row[0] == mtime:
+                return self._subdirectories(directory)
+        entries = []
+        try:
+            with os.scandir(directory) as scan:
+                for entry in scan:
+                    try:
+                        stat = entry.stat()
+                        entries.append((entry.path, directory, entry.name,
+                                        os.path.splitext(entry.name)[1],
+                                        stat.st_size, stat.st_mtime_ns,
+                                        stat.st_ctime_ns, entry.is_file(),
+                                        entry.is_dir(), entry.is_symlink()))
+                    except OSError:
+                        # broken links and entries removed since the scan
+                        pass
+        except OSError:
+            with self._lock, self._db:
+                self._deleteTree(directory)
+            return []
+        # a directory changed within the same mtime tick as its scan isn't
+        # trusted, so it's rescanned next time
+        if time.time_ns() - mtime < directoryCacheSettle * 1e9:
+            mtime = -1
+        # names that are still directories the index descends into
+        directoryNames = {entry[2] for entry in entries
+                          if entry[8] and not entry[9]}
+        with self._lock, self._db:
+            # subtrees of directories that are gone or were replaced by a
+            # file or link
+            for path, name in self._db.execute(
+                    "SELECT path, name FROM entries WHERE directory = ? AND "
+                    "isDir AND NOT isLink", (directory,)).fetchall():
+                if name not in directoryNames:
+                    self._deleteTree(path)
+            self._db.execute("DELETE FROM entries WHERE directory = ?",
+                             (directory,))
+            self._db.executemany("INSERT OR REPLACE INTO entries VALUES "
+                                 "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", entries)
+            self._db.execute("INSERT OR REPLACE INTO directories VALUES "
+                             "(?, ?)", (directory, mtime))
+            return self._subdirectories(directory)
+
+    def _subdirectories(self, directory):
+        return [path for (path,) in self._db.execute(
+            "SELECT path FROM entries WHERE directory = ? AND isDir AND NOT "
+            "isLink", (directory,))]
+
+    # Remove a directory and everything under it from the index
+    def _deleteTree(self, directory):
+        start, end = self._treeRange(directory)
+        self._db.execute("DELETE FROM entries WHERE path = ? OR "
+                         "(path > ? AND path < ?)", (directory, start, end))
+        self._db.execute("DELETE FROM directories WHERE path = ? OR "
+                         "(path > ? AND path < ?)", (directory, start, end))
+
+    # Paths under a directory sort between these two strings
+    @staticmethod
+    def _treeRange(directory):
+        start = os.path.join(directory, "")
+        return start, start[:-1] + chr(ord(os.sep) + 1)
+
+    # This method returns True if the path is in the index.
+    def exists(self, path):
+        path = os.path.abspath(path)
+        if path == self._root:
+            return os.path.isdir(path)
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM entries WHERE path = ?",
+                                    (path,)).fetchone() is not None
+
+    # This method returns the indexed entries of a directory like
+    # fileIO.listDirectory, or None if the directory isn't in the index.
+    # Recursive listings give paths relative to directory. Entries can be
+    # filtered by extension and glob style pattern matched against names.
+    def listDirectory(self, directory, listFiles=True, listDirectories=True,
+                      recursive=False, extension="", pattern=None):
+        directory = os.path.abspath(directory)
+        with self._lock:
+            if self._db.execute("SELECT 1 FROM directories WHERE path = ?",
+                                (directory,)).fetchone() is None:
+                return None
+        if not (listFiles or listDirectories):
+            return []
+        paths = self.find(directory, recursive, extension, pattern,
+                          listFiles=listFiles, listDirectories=listDirectories)
+        start = len(os.path.join(directory, ""))
+        return [path[start:] for path in paths]
+
+    # This method returns the paths of indexed entries under directory (the
+    # root by default) that match all the given filters. modifiedAfter and
+    # modifiedBefore are times in seconds like os.path.getmtime returns.
+    # Paths are returned sorted.
+    def find(self, directory=None, recursive=True, extension="", pattern=None,
+             modifiedAfter=None, modifiedBefore=None, listFiles=True,
+             listDirectories=False):
+        directory = self._root if directory is None else \
+            os.path.abspath(directory)
+        if recursive:
+            conditions = ["path > ? AND path < ?"]
+            parameters = list(self._treeRange(directory))
+        else:
+            conditions = ["directory = ?"]
+            parameters = [directory]
+        if listFiles and not listDirectories:
+            conditions.append("isFile")
+        elif listDirectories and not listFiles:
+            conditions.append("isDir")
+        elif listFiles and listDirectories:
+            conditions.append("(isFile OR isDir)")
+        else:
+            return []
+        self._addFilters(conditions, parameters, extension, pattern,
+                         modifiedAfter, modifiedBefore)
+        with self._lock:
+            return [path for (path,) in self._db.execute(
+                "SELECT path FROM entries WHERE " + " AND ".join(conditions) +
+                " ORDER BY path", parameters)]
+
+    # This method returns the paths of the k files in a directory (not its
+    # subdirectories) with the latest ctimes, newest first, like
+    # fileIO.newestFiles, joined to directory as it is given. Returns None if
+    # the directory isn't in the index.
+    def newestFiles(self, directory, k, extension=""):
+        path = os.path.abspath(directory)
+        conditions = ["directory = ?", "isFile"]
+        parameters = [path]
+        self._addFilters(conditions, parameters, extension)
+        with self._lock:
+            if self._db.execute("SELECT 1 FROM directories WHERE path = ?",
+                                (path,)).fetchone() is None:
+                return None
+            # joined to directory as given, like fileIO.newestFiles does
+            return [os.path.join(directory, name) for (name,) in
+                    self._db.execute(
+                        "SELECT name FROM entries WHERE " +
+                        " AND ".join(conditions) +
+                        " ORDER BY ctime DESC, path DESC LIMIT ?",
+                        parameters + [k])]
+
+    # This method returns (size, mtime) for an indexed path, with mtime in
+    # seconds, or None if it isn't in the index.
+    def stat(self, path):
+        with self._lock:
+            row = self._db.execute("SELECT size, mtime FROM entries WHERE "
+                                   "path = ?", (os.path.abspath(path),)
+                                   ).fetchone()
+        if row is None:
+            return None
+        return row[0], row[1] / 1e9
+
+    @staticmethod
+    def _addFilters(conditions, parameters, extension="", pattern=None,
+                    modifiedAfter=None, modifiedBefore=None):
+        if extension:
+            if extension.startswith(".") and extension.count(".") == 1:
+                # uses the extension column index, and matches names like
+                # ".csv" that have no extension but end with it
+                conditions.append("(extension = ? OR name = ?)")
+                parameters += [extension, extension]
+            else:
+                conditions.append("substr(name, -?) = ?")
+                parameters += [len(extension), extension]
+        if pattern is not None:
+            conditions.append("fnmatch(name, ?)")
+            parameters.append(pattern)
+        if modifiedAfter is not None:
+            conditions.append("mtime >= ?")
+            parameters.append(int(modifiedAfter * 1e9))
+        if modifiedBefore is not None:
+            conditions.append("mtime < ?")
+            parameters.append(int(modifiedBefore * 1e9))
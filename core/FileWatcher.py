@@ -0,0 +1,267 @@
+# Copyright (c) 2023 The Old Man and the C
+#
+# This file is part of mvcTkinter.
+#
+# mvcTkinter is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# mvcTkinter is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU Affero General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Affero General Public License along
+# with mvcTkinter. If not, see <https://www.gnu.org/licenses/>.
+
+# FileWatcher class
+# Watches files and directories for changes and calls a callback on the Tk
+# thread with the set of watched paths that changed. Changes that arrive within
+# coalesce milliseconds of each other are delivered together.
+# On Linux, inotify is used through ctypes, and its file descriptor is read by
+# a Tk file handler, so nothing runs while nothing changes. Each path is
+# watched through the directory it is in (or itself for directories), so files
+# that are replaced by a rename are still followed. Elsewhere, and for paths
+# whose directory doesn't exist yet, paths are checked every interval
+# milliseconds by comparing their inode, mtime and size.
+# A directory counts as changed when entries are created, deleted or renamed in
+# it, not when the files in it are written, so watch the files themselves for
+# that.
+
+import ctypes
+import ctypes.util
+import os
+import struct
+import sys
+import tkinter as tk
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+
+entryEvents = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO
+contentEvents = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE
+watchMask = entryEvents | contentEvents | IN_DELETE_SELF | IN_MOVE_SELF | \
+    IN_ONLYDIR
+
+# struct inotify_event without the name that follows it
+eventHeader = struct.Struct("iIII")
+
+
+def _loadInotify():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p,
+                                           ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+inotify = _loadInotify()
+
+
+class FileWatcher:
+    def __init__(self, master, callback, interval=1000, coalesce=100):
+        self._master = master
+        self._callback = callback
+        self._interval = interval
+        self._coalesce = coalesce
+        # watched paths and the directory each is watched through, or None if
+        # it is polled
+        self._paths = dict()
+        self._watches = dict()
+        self._directories = dict()
+        self._signatures = dict()
+        self._pending = set()
+        self._flushTimer = None
+        self._pollTimer = None
+        self._fd = None
+        if inotify is not None:
+            fd = inotify.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd >= 0:
+                self._fd = fd
+                master.tk.createfilehandler(fd, tk.READABLE,
+                                            self._readEvents)
+
+    # This method returns True if changes are reported by inotify rather than
+    # by polling.
+    def usesInotify(self):
+        return self._fd is not None
+
+    # This method starts watching a file or directory. The path doesn't have
+    # to exist yet.
+    def watch(self, path):
+        path = os.path.abspath(path)
+        if path in self._paths:
+            return
+        self._paths[path] = None
+        self._signatures[path] = _signature(path)
+        if not self._addWatch(path):
+            self._schedulePoll()
+
+    # This method stops watching a file or directory.
+    def unwatch(self, path):
+        path = os.path.abspath(path)
+        if path not in self._paths:
+            return
+        self._removeWatch(path)
+        del self._paths[path]
+        self._signatures.pop(path, None)
+        self._pending.discard(path)
+
+    # This method returns the watched paths.
+    def paths(self):
+        return list(self._paths)
+
+    # This method stops watching everything and releases the inotify file
+    # descriptor.
+    def close(self):
+        for timer in (self._flushTimer, self._pollTimer):
+            if timer is not None:
+                self._master.after_cancel(timer)
+        self._flushTimer = None
+        self._pollTimer = None
+        if self._fd is not None:
+            self._master.tk.deletefilehandler(self._fd)
+            os.close(self._fd)
+            self._fd = None
+        self._paths.clear()
+        self._watches.clear()
+        self._directories.clear()
+        self._signatures.clear()
+        self._pending.clear()
+
+    # Watch a path with inotify through its directory. Returns False if it has
+    # to be polled instead.
+    def _addWatch(self, path):
+        if self._fd is None:
+            return False
+        directory = path if os.path.isdir(path) else os.path.dirname(path)
+        if directory not in self._watches:
+            wd = inotify.inotify_add_watch(self._fd, os.fsencode(directory),
+                                           watchMask)
+            if wd < 0:
+                return False
+            self._watches[directory] = wd
+            self._directories[wd] = directory
+        self._paths[path] = directory
+        return True
+
+    # Stop watching a path with inotify, and remove the watch on its directory
+    # if no other path uses it
+    def _removeWatch(self, path):
+        directory = self._paths[path]
+        self._paths[path] = None
+        if directory is not None and \
+                directory not in self._paths.values():
+            wd = self._watches.pop(directory)
+            self._directories.pop(wd, None)
+            inotify.inotify_rm_watch(self._fd, wd)
+
+    def _readEvents(self, *_):
+        try:
+            data = os.read(self._fd, 65536)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = eventHeader.unpack_from(data, offset)
+            offset += eventHeader.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            self._handleEvent(wd, mask, name)
+        self._scheduleFlush()
+
+    def _handleEvent(self, wd, mask, name):
+        if mask & IN_Q_OVERFLOW:
+            # events were lost, so anything could have changed
+            self._pending.update(self._paths)
+            return
+        directory = self._directories.get(wd)
+        if directory is None:
+            return
+        if mask & IN_MOVE_SELF:
+            # the watch follows the directory to where it was moved, so drop
+            # it, which is then reported as IN_IGNORED
+            inotify.inotify_rm_watch(self._fd, wd)
+            return
+        if mask & IN_IGNORED:
+            # the directory is gone, so poll its paths until it comes back
+            self._watches.pop(directory, None)
+            self._directories.pop(wd, None)
+            for path, watchedDirectory in self._paths.items():
+                if watchedDirectory == directory:
+                    self._paths[path] = None
+                    self._signatures[path] = _signature(path)
+                    self._pending.add(path)
+            self._schedulePoll()
+            return
+        if not name:
+            if mask & IN_DELETE_SELF and directory in self._paths:
+                self._pending.add(directory)
+            return
+        path = os.path.join(directory, name)
+        if path in self._paths and mask & (entryEvents | contentEvents):
+            self._pending.add(path)
+            if mask & (IN_CREATE | IN_MOVED_TO) and os.path.isdir(path):
+                # a watched directory was created, so watch it directly
+                self._removeWatch(path)
+                self._addWatch(path)
+        if directory in self._paths and mask & entryEvents:
+            self._pending.add(directory)
+
+    def _scheduleFlush(self):
+        if self._pending and self._flushTimer is None:
+            self._flushTimer = self._master.after(self._coalesce, self._flush)
+
+    def _flush(self):
+        self._flushTimer = None
+        paths = self._pending
+        self._pending = set()
+        if paths:
+            self._callback(paths)
+
+    def _schedulePoll(self):
+        if self._pollTimer is None:
+            self._pollTimer = self._master.after(self._interval, self._poll)
+
+    # Check the polled paths for changes, and move them back to inotify if
+    # their directory exists again
+    def _poll(self):
+        self._pollTimer = None
+        polled = [path for path, directory in self._paths.items()
+                  if directory is None]
+        for path in polled:
+            signature = _signature(path)
+            if signature != self._signatures[path]:
+                self._signatures[path] = signature
+                self._pending.add(path)
+            self._addWatch(path)
+        if None in self._paths.values():
+            self._schedulePoll()
+        self._scheduleFlush()
+
+
+# The parts of a path's stat result that show it changed, or None if it
+# doesn't exist
+def _signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
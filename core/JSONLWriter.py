@@ -0,0 +1,184 @@
+# Copyright (c) 2023 The Old Man and the C
+#
+# This file is part of mvcTkinter.
+#
+# mvcTkinter is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# mvcTkinter is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU Affero General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Affero General Public License along
+# with mvcTkinter. If not, see <https://www.gnu.org/licenses/>.
+
+# JSONLWriter class
+# Appends records to a JSON Lines file, one compact JSON value per line. Records
+# are encoded when they are written and kept in memory, and a background thread
+# appends them to the file once bufferSize characters are waiting or
+# flushInterval seconds after the last flush. If writes get more than four
+# buffers ahead of the thread, the writing thread flushes itself, so memory
+# stays bounded.
+# If maxSize is set, the file is rotated before it would grow past maxSize
+# bytes, like logging.handlers.RotatingFileHandler: file is renamed to file.1,
+# file.1 to file.2 and so on, keeping up to backups old files. A record is
+# never split between files.
+# Writers are flushed and closed at exit if they weren't closed before. An
+# error in the background thread is raised by the next write, flush or close.
+# Keyword arguments are passed to json.JSONEncoder, except indent, since each
+# record has to be on one line.
+
+import atexit
+import json
+import os
+import threading
+
+
+class JSONLWriter:
+    def __init__(self, file, bufferSize=1024 * 1024, flushInterval=1.0,
+                 maxSize=None, backups=5, encoding="utf8", **kwargs):
+        self._file = file
+        self._bufferSize = bufferSize
+        self._flushInterval = flushInterval
+        self._maxSize = maxSize
+        self._backups = backups
+        self._encoding = encoding
+        kwargs.pop("indent", None)
+        kwargs.setdefault("separators", (",", ":"))
+        self._encode = json.JSONEncoder(**kwargs).encode
+        self._lines = []
+        self._buffered = 0
+        self._lock = threading.Lock()
+        self._writeLock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._error = None
+        self._fileObject = open(file, "a", encoding=encoding)
+        self._size = self._fileObject.tell()
+        self.recordsWritten = 0
+        self._thread = threading.Thread(target=self._flushLoop, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    # This method returns the path of the file being written.
+    def file(self):
+        return self._file
+
+    # This method adds a record to be appended to the file.
+    def write(self, record):
+        line = self._encode(record) + "\n"
+        with self._lock:
+            self._checkOpen()
+            self._lines.append(line)
+            self._buffered += len(line)
+            buffered = self._buffered
+        if buffered >= self._bufferSize:
+            if buffered >= 4 * self._bufferSize:
+                self.flush()
+            else:
+                self._wake.set()
+
+    # This method adds several records to be appended to the file.
+    def writeMany(self, records):
+        for record in records:
+            self.write(record)
+
+    # This method appends all the waiting records to the file.
+    def flush(self):
+        with self._writeLock:
+            with self._lock:
+                self._checkError()
+                lines = self._lines
+                self._lines = []
+                self._buffered = 0
+            if lines and self._fileObject is not None:
+                self._writeLines(lines)
+
+    # This method flushes the waiting records and closes the file. It can be
+    # called more than once.
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        atexit.unregister(self.close)
+        self._wake.set()
+        self._thread.join()
+        try:
+            self.flush()
+        finally:
+            with self._writeLock:
+                self._fileObject.close()
+                self._fileObject = None
+
+    def _checkOpen(self):
+        if self._closed:
+            raise ValueError("write to closed JSONLWriter")
+        self._checkError()
+
+    def _checkError(self):
+        if self._error is not None:
+            error = self._error
+            self._error = None
+            raise error
+
+    def _flushLoop(self):
+        while not self._closed:
+            self._wake.wait(self._flushInterval)
+            self._wake.clear()
+            if self._closed:
+                return
+            try:
+                self.flush()
+            except Exception as error:
+                self._error = error
+
+    # Write lines, rotating the file between lines when the next ones would
+    # take it past maxSize. Must be called with _writeLock held.
+    def _writeLines(self, lines):
+        if self._maxSize is None:
+            self._write("".join(lines))
+            return
+        start = 0
+        size = 0
+        for index, line in enumerate(lines):
+            lineSize = len(line.encode(self._encoding)) \
+                if not line.isascii() else len(line)
+            if self._size + size + lineSize > self._maxSize and \
+                    self._size + size > 0:
+                self._write("".join(lines[start:index]))
+                self._rotate()
+                start = index
+                size = 0
+            size += lineSize
+        self._write("".join(lines[start:]))
+
+    def _write(self, text):
+        if not text:
+            return
+        self._fileObject.write(text)
+        self._fileObject.flush()
+        self._size = self._fileObject.tell()
+        self.recordsWritten += text.count("\n")
+
+    def _rotate(self):
+        self._fileObject.close()
+        for number in range(self._backups - 1, 0, -1):
+            backup = "{}.{}".format(self._file, number)
+            if os.path.exists(backup):
+                os.replace(backup, "{}.{}".format(self._file, number + 1))
+        if self._backups > 0:
+            os.replace(self._file, self._file + ".1")
+        else:
+            os.remove(self._file)
+        self._fileObject = open(self._file, "a", encoding=self._encoding)
+        self._size = 0
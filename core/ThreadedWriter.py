@@ -0,0 +1,112 @@
+# Copyright (c) 2023 The Old Man and the C
+#
+# This file is part of mvcTkinter.
+#
+# mvcTkinter is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# mvcTkinter is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU Affero General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Affero General Public License along
+# with mvcTkinter. If not, see <https://www.gnu.org/licenses/>.
+
+# ThreadedWriter class
+# Wraps a writable file object so writes are collected into blocks of about
+# blockSize characters or bytes that a background thread writes to the file.
+# This lets the work the file does on each write, like compression, run while
+# the writing thread produces the next block, since zlib, bz2 and lzma release
+# the GIL while compressing. At most queueSize blocks wait for the thread.
+# Closing the writer writes the remaining data and closes the file. An error
+# in the thread is raised by the next write or by close.
+
+import queue
+import threading
+
+
+class ThreadedWriter:
+    def __init__(self, fileObject, blockSize=1024 * 1024, queueSize=4):
+        self._fileObject = fileObject
+        self._blockSize = blockSize
+        self._pieces = []
+        self._buffered = 0
+        self._queue = queue.Queue(queueSize)
+        self._error = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._writeLoop, daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if self._closed:
+            raise ValueError("write to closed file")
+        self._checkError()
+        self._pieces.append(data)
+        self._buffered += len(data)
+        if self._buffered >= self._blockSize:
+            self._sendBlock()
+        return len(data)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    # Data is written to the file by the thread, so flushing only hands the
+    # current block to it.
+    def flush(self):
+        self._checkError()
+        self._sendBlock()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self._sendBlock()
+            self._queue.put(None)
+            self._thread.join()
+        finally:
+            self._fileObject.close()
+        self._checkError()
+
+    def _sendBlock(self):
+        if not self._pieces:
+            return
+        # bytes-like pieces such as memoryviews have no join of their own
+        joiner = "" if isinstance(self._pieces[0], str) else b""
+        block = joiner.join(self._pieces)
+        self._pieces = []
+        self._buffered = 0
+        self._queue.put(block)
+
+    def _checkError(self):
+        if self._error is not None:
+            error = self._error
+            self._error = None
+            raise error
+
+    def _writeLoop(self):
+        while (block := self._queue.get()) is not None:
+            if self._error is not None:
+                # keep taking blocks so the writing thread isn't blocked
+                continue
+            try:
+                self._fileObject.write(block)
+            except Exception as error:
+                self._error = error
@@ -16,14 +16,53 @@
 # with mvcTkinter. If not, see <https://www.gnu.org/licenses/>.
 
 # Methods for file I/O operations
+import atexit
+import bz2
+import codecs
 import csv
+import errno
+import fnmatch
+import gzip
+import hashlib
+import heapq
+import io
 import json
+import locale
+import lzma
 import os
+import pickle
+import queue
+import re
+import selectors
 import sys
 import shutil
 import subprocess
 import shlex
+import struct
+import tempfile
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, \
+    as_completed
+from contextlib import contextmanager
+from itertools import chain, islice, repeat
+from mmap import mmap as MemoryMap, ACCESS_READ
 from warnings import warn
+from .CommandServer import CommandServer
+from .JSONLWriter import JSONLWriter
+from .ThreadedWriter import ThreadedWriter
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 validOpenArgs = ["file", "mode", "buffering", "encoding", "errors", "newline",
                  "closefd", "opener"]
@@ -36,7 +75,116 @@ validCSVArgs = ["csvfile", "dialect", "delimiter", "doublequote", "escapechar",
                 "lineterminator", "quotechar", "quoting", "skipinitialspace",
                 "strict"]
 
+# Openers for compressed files by file name extension. Files with these
+# extensions are decompressed and compressed as they are read and written by
+# the functions here, and the keyword argument each opener takes for the
+# compression level.
+compressedOpeners = {".gz": gzip.open, ".bz2": bz2.open, ".xz": lzma.open}
+compressLevelArgs = {".gz": "compresslevel", ".bz2": "compresslevel",
+                     ".xz": "preset"}
+
+# Approximate size in bytes of the pieces readCSVParallel splits files into
+csvChunkSize = 64 * 1024 * 1024
+# A line that can't appear in CSV data by itself, used to check that a chunk
+# ended outside a quoted field
+csvChunkSentinel = "\0mvcTkinterChunkEnd\0"
+
+# Suffix of the row offset index files written next to CSV files, the number
+# of rows between indexed offsets, and the index file header layout (magic,
+# CSV mtime_ns, CSV size, stride, row count, quote byte)
+csvIndexSuffix = ".idx"
+csvIndexStride = 64
+csvIndexHeader = struct.Struct("<8sqqqqB")
+csvIndexMagic = b"MTKCSVIX"
+csvIndexes = dict()
+
+# Size in bytes of the pieces memory mapped text is decoded in
+mappedChunkSize = 1024 * 1024
+
+# Directory listings cached by listDirectory and iterDirectory, keyed by
+# absolute path, with the directory mtime_ns they were read at. A listing is
+# only kept if the directory mtime was at least directoryCacheSettle seconds
+# old when it was read, since changes within the same mtime tick can't be seen.
+directoryCache = dict()
+directoryCacheSettle = 2.0
+# Results cached by newestFiles and latestFile, keyed by absolute directory
+# path, extension and count, with the directory mtime_ns they were found at
+newestFilesCache = dict()
+
+# Number of characters iterJSON reads at a time, and the whitespace JSON allows
+# between values
+jsonChunkSize = 1024 * 1024
+jsonWhitespace = re.compile(r"[ \t\n\r]*")
+# File name extensions iterJSON always reads as JSON Lines
+jsonLinesExtensions = {".jsonl", ".ndjson"}
+# Serializers readJSON and writeJSON can use instead of the json module, by
+# name, as (dumps, loads) pairs added with registerSerializer. Files written by
+# the "pickle" serializer start with pickleMagic, and the out of band buffers
+# in them start at multiples of pickleAlignment bytes.
+serializers = dict()
+pickleMagic = b"MTKPKL5\n"
+pickleAlignment = 64
+
+# File contents cached by readFile, readJSON and readCSV with cache=True, keyed
+# by function, absolute path and arguments, least recently used first. Each
+# entry holds the file's (mtime_ns, size, inode) when it was read, the result,
+# and the file size, which is what counts towards readCacheLimit bytes. Files
+# changed less than readCacheSettle seconds before they were read aren't cached,
+# since a change within the same mtime tick can't be seen.
+readCache = OrderedDict()
+readCachePaths = dict()
+readCacheLimit = 64 * 1024 * 1024
+readCacheSettle = 2.0
+readCacheCounts = {"hits": 0, "misses": 0, "evictions": 0, "bytes": 0}
+readCacheLock = threading.Lock()
+
+# Size in bytes of the pieces files are copied in by copyFile and
+# copyDirectory, between which progress is reported and cancellation checked,
+# and the number of files copyDirectory copies at once by default
+copyChunkSize = 8 * 1024 * 1024
+copyWorkers = 8
+# Seconds that file mtimes can differ by for syncDirectory to treat them as
+# the same, for file systems that store coarser times
+syncMtimeWindow = 0
+
+# Seconds between checks for timeouts and cancellation while shell commands
+# run
+shellPollInterval = 0.05
+
+# The shared CommandServer used by shellCmd(persistent=True)
+commandServer = None
+
 settings = dict()
+# Seconds that setSetting waits to write the settings file in write-behind
+# mode, so a burst of changes is written once. None writes immediately.
+settingsWriteDelay = None
+settingsLock = threading.RLock()
+settingsWriteLock = threading.Lock()
+# Held by flushSettings from taking the dirty settings until they are written,
+# so a later flush (like the one at exit) waits for one in progress.
+settingsFlushLock = threading.Lock()
+settingsDirty = set()
+settingsTimer = None
+settingsStats = {"requested": 0, "written": 0}
+# In journal mode, setSetting appends changed settings to a journal file next
+# to the settings file instead of rewriting it, and the journal is compacted
+# into the settings file once it is larger than settingsJournalLimit bytes.
+settingsJournal = False
+settingsJournalLimit = 1024 * 1024
+settingsJournalSuffix = ".journal"
+# Registered settings namespaces. Settings with keys starting with a namespace
+# and "." are kept in their own file, loaded on first use (None until then).
+settingsNamespaces = dict()
+# In shared mode, several processes can use the same settings files. Writes
+# hold an advisory lock on a .lock file next to the settings file and merge in
+# changes other processes made, and settings are re-read when their file
+# changes on disk, which is detected from the signatures (inode, mtime and
+# size of each file and its journal) recorded when it was last read or written.
+settingsShared = False
+settingsSignatures = dict()
+# The serializer settings files are written with. Journals are always JSON
+# Lines.
+settingsSerializer = "stdlib"
 
 
 # Get a path to a resource from a relative path for both normal source
@@ -55,11 +203,18 @@ def currentDir():
     return os.getcwd()
 
 
-# Check if a path exists and handle None as False
-def pathExists(path):
-    if path is not None:
-        return os.path.exists(path)
-    return False
+# Check if a path exists and handle None as False. If a ready DirectoryIndex is
+# given, paths under its root are looked up in the index.
+def pathExists(path, index=None):
+    if path is None:
+        return False
+    if _useIndex(index, path):
+        return index.exists(path)
+    return os.path.exists(path)
+
+
+def _useIndex(index, path):
+    return index is not None and index.ready() and index.contains(path)
 
 
 # Create a directory tree
@@ -74,59 +229,587 @@ def deleteDirectory(directory):
         shutil.rmtree(directory, ignore_errors=True)
 
 
-# List directory
-def listDirectory(directory, listFiles=True, listDirectories=True):
-    if not os.path.exists(directory) or not os.path.isdir(directory):
+# List directory. Entry types come from os.scandir, so there are no extra stat
+# calls for each entry except for symbolic links. If cache is set, the listing
+# is cached and reused until the directory's mtime changes. Changes to the
+# targets of symbolic links don't change the mtime, so cached listings don't
+# see them. Any other keyword arguments (recursive, extension, pattern) are
+# passed to iterDirectory. If a ready DirectoryIndex is given, directories
+# under its root are listed from the index.
+def listDirectory(directory, listFiles=True, listDirectories=True, cache=False,
+                  index=None, **kwargs):
+    if _useIndex(index, directory):
+        paths = index.listDirectory(directory, listFiles, listDirectories,
+                                    **kwargs)
+        if paths is not None:
+            return paths
+    if not os.path.isdir(directory):
+        return None
+    if kwargs:
+        return list(iterDirectory(directory, listFiles, listDirectories,
+                                  cache=cache, **kwargs))
+    entries = _scanDirectory(directory, cache) or []
+    return [name for name, isFile, isDir, _ in entries
+            if (listFiles and isFile) or (listDirectories and isDir)]
+
+
+# Iterate over the names of the entries in a directory. If recursive is set,
+# subdirectories are also listed (without following symbolic links to
+# directories), and paths relative to directory are yielded, each directory
+# before its contents. Entries can be filtered by a file name extension and by
+# a glob style pattern matched against the entry name. Unreadable directories
+# are skipped. Uses the listing cache if cache is set.
+def iterDirectory(directory, listFiles=True, listDirectories=True,
+                  recursive=False, extension="", pattern=None, cache=False):
+    directories = [""]
+    while directories:
+        subdirectory = directories.pop()
+        entries = _scanDirectory(os.path.join(directory, subdirectory), cache)
+        if entries is None:
+            continue
+        subdirectories = []
+        for name, isFile, isDir, isLink in entries:
+            if recursive and isDir and not isLink:
+                subdirectories.append(os.path.join(subdirectory, name))
+            if not ((listFiles and isFile) or (listDirectories and isDir)):
+                continue
+            if not name.endswith(extension):
+                continue
+            if pattern is not None and not fnmatch.fnmatch(name, pattern):
+                continue
+            yield os.path.join(subdirectory, name)
+        # walk subdirectories in listing order
+        directories.extend(reversed(subdirectories))
+
+
+# Clear the listing cache for a directory, or for every directory
+def clearDirectoryCache(directory=None):
+    if directory is None:
+        directoryCache.clear()
+    else:
+        directoryCache.pop(os.path.abspath(directory), None)
+
+
+# Return a list of (name, isFile, isDir, isLink) tuples for the entries in a
+# directory, or None if it can't be read
+def _scanDirectory(directory, cache):
+    key = os.path.abspath(directory)
+    try:
+        mtime = os.stat(directory).st_mtime_ns
+    except OSError:
+        directoryCache.pop(key, None)
+        return None
+    if cache:
+        cached = directoryCache.get(key)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+    try:
+        with os.scandir(directory) as scan:
+            entries = [(entry.name, entry.is_file(), entry.is_dir(),
+                        entry.is_symlink()) for entry in scan]
+    except OSError:
+        return None
+    if cache:
+        if time.time_ns() - mtime >= directoryCacheSettle * 1e9:
+            directoryCache[key] = (mtime, entries)
+        else:
+            directoryCache.pop(key, None)
+    return entries
+
+
+# Copy directory. The directory tree is created first, then files are copied
+# largest first by a pool of worker threads (copyWorkers by default) the same
+# way as copyFile, with their metadata copied like shutil.copytree does.
+# Symbolic links are followed. progress and cancel work as they do for
+# copyFile, with progress called from the worker threads with the totals for
+# the whole directory. Returns True once everything is copied, or False if it
+# was cancelled (files already copied are kept). Errors are collected and
+# raised together as a shutil.Error like shutil.copytree.
+def copyDirectory(source, destination, existOK=False, workers=None,
+                  progress=None, cancel=None):
+    os.makedirs(destination, exist_ok=existOK)
+    directories, files, errors = _walkTree(source, destination)
+    _createDirectories(directories, errors)
+    report = _copyProgress(progress, sum(size for size, _, _ in files),
+                           len(files))
+    results = _copyTreeFiles(
+        directories, files, errors, workers,
+        lambda size, file, copy: _copyFile(file, copy, cancel, report, True))
+    return results is not None
+
+
+# Make a directory match another one, copying only the files that changed
+# since the last sync. Files are skipped if the copy has the same size and
+# mtime (within syncMtimeWindow seconds), or if compare is "hash", the same
+# size and content, found by hashing both files in the worker threads over
+# memory maps. The metadata of copies found equal by hashing is updated so
+# they match by mtime next time. If delete is set, entries in destination that
+# aren't in source are removed first. Other arguments work as they do for
+# copyDirectory, with skipped files counted as copied for progress. Returns a
+# dictionary with the numbers of files "copied" and "skipped", and of entries
+# "deleted" (a removed directory counts once), or False if it was cancelled.
+def syncDirectory(source, destination, compare="mtime", delete=False,
+                  workers=None, progress=None, cancel=None):
+    os.makedirs(destination, exist_ok=True)
+    directories, files, errors = _walkTree(source, destination)
+    deleted = _deleteExtraEntries(directories, files, errors) if delete else 0
+    _createDirectories(directories, errors)
+    report = _copyProgress(progress, sum(size for size, _, _ in files),
+                           len(files))
+    results = _copyTreeFiles(
+        directories, files, errors, workers,
+        lambda size, file, copy: _syncFile(size, file, copy, compare, cancel,
+                                           report))
+    if results is None:
+        return False
+    return {"copied": results.count("copied"),
+            "skipped": results.count("skipped"), "deleted": deleted}
+
+
+def _syncFile(size, file, copy, compare, cancel, report):
+    try:
+        copyStat = os.stat(copy)
+    except OSError:
+        copyStat = None
+    if copyStat is not None and copyStat.st_size == size:
+        if compare == "hash":
+            same = _fileHash(file, cancel) == _fileHash(copy, cancel)
+            if cancel is not None and cancel.is_set():
+                return False
+            if same:
+                shutil.copystat(file, copy)
+        else:
+            same = abs(os.stat(file).st_mtime_ns - copyStat.st_mtime_ns) <= \
+                syncMtimeWindow * 1e9
+        if same:
+            report(size, 1)
+            return "skipped"
+    if not _copyFile(file, copy, cancel, report, True):
+        return False
+    return "copied"
+
+
+# Hash a file's content over a memory map, in pieces so cancellation is
+# checked. The hash releases the GIL, so files are hashed in parallel.
+def _fileHash(file, cancel):
+    fileHash = hashlib.blake2b()
+    with mapFile(file) as mapping:
+        view = memoryview(mapping)
+        for start in range(0, len(view), copyChunkSize):
+            if cancel is not None and cancel.is_set():
+                break
+            fileHash.update(view[start:start + copyChunkSize])
+        view.release()
+    return fileHash.digest()
+
+
+# Remove the entries in the destination directories that aren't in the source
+# tree or are a different type there, and return the number removed
+def _deleteExtraEntries(directories, files, errors):
+    copies = {copy for _, copy in directories}
+    fileCopies = {copy for _, _, copy in files}
+    deleted = 0
+    for _, copy in directories:
+        try:
+            with os.scandir(copy) as scan:
+                entries = list(scan)
+        except OSError:
+            continue
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.path in copies:
+                        continue
+                    shutil.rmtree(entry.path)
+                elif entry.path in fileCopies:
+                    continue
+                else:
+                    os.remove(entry.path)
+                deleted += 1
+            except OSError as error:
+                errors.append((entry.path, entry.path, str(error)))
+    return deleted
+
+
+# Copy the files of a tree with a pool of worker threads running task for
+# each (size, file, copy) file, largest first, then copy the directory
+# metadata. Returns a list of the task results, or None if a task returned
+# False because it was cancelled. Errors are raised as a shutil.Error.
+def _copyTreeFiles(directories, files, errors, workers, task):
+    files.sort(key=lambda file: file[0], reverse=True)
+    results = []
+    with ThreadPoolExecutor(workers or copyWorkers) as executor:
+        futures = {executor.submit(task, *file): file for file in files}
+        for future in as_completed(futures):
+            try:
+                results.append(future.result())
+            except OSError as error:
+                _, file, copy = futures[future]
+                errors.append((file, copy, str(error)))
+    if False in results:
         return None
-    paths = [path for path in os.listdir(directory)
-             if (listFiles and os.path.isfile(os.path.join(directory, path))) or
-                 (listDirectories and
-                  os.path.isdir(os.path.join(directory, path)))]
-    return paths
+    for directory, copy in reversed(directories):
+        try:
+            shutil.copystat(directory, copy)
+        except OSError as error:
+            errors.append((directory, copy, str(error)))
+    if errors:
+        raise shutil.Error(errors)
+    return results
+
+
+# Return the (directory, copy) pairs of a tree's directories, starting with
+# source itself, the (size, file, copy) of each file, and any errors
+def _walkTree(source, destination):
+    directories = [(source, destination)]
+    files = []
+    errors = []
+    index = 0
+    while index < len(directories):
+        directory, copy = directories[index]
+        index += 1
+        try:
+            with os.scandir(directory) as scan:
+                entries = list(scan)
+        except OSError as error:
+            errors.append((directory, copy, str(error)))
+            continue
+        for entry in entries:
+            entryCopy = os.path.join(copy, entry.name)
+            try:
+                if entry.is_dir():
+                    directories.append((entry.path, entryCopy))
+                else:
+                    files.append((entry.stat().st_size, entry.path,
+                                  entryCopy))
+            except OSError as error:
+                errors.append((entry.path, entryCopy, str(error)))
+    return directories, files, errors
+
+
+def _createDirectories(directories, errors):
+    for directory, copy in directories:
+        try:
+            os.makedirs(copy, exist_ok=True)
+        except OSError as error:
+            errors.append((directory, copy, str(error)))
+
 
+# Return a thread safe function that adds to the bytes and files copied and
+# reports the totals to progress
+def _copyProgress(progress, bytesTotal, filesTotal):
+    lock = threading.Lock()
+    done = [0, 0]
 
-# Copy directory
-def copyDirectory(source, destination, existOK=False):
-    shutil.copytree(source, destination, dirs_exist_ok=existOK)
+    def report(bytesCopied, filesCopied=0):
+        if progress is None:
+            return
+        with lock:
+            done[0] += bytesCopied
+            done[1] += filesCopied
+            bytesDone, filesDone = done
+        progress(bytesDone, bytesTotal, filesDone, filesTotal)
+    return report
 
 
-# Return the most recently modified file in a directory with optional extension
-def latestFile(directory, extension=""):
+# Return the most recently modified file in a directory with optional
+# extension, or None if there isn't one. Keyword arguments are passed to
+# newestFiles.
+def latestFile(directory, extension="", **kwargs):
     if not directory:
         return None
-    paths = []
-    for entry in os.scandir(directory):
-        if entry.is_file() and entry.path.endswith(extension):
-            paths.append(entry.path)
-    file = max(paths, key=os.path.getctime)
-    return file
+    files = newestFiles(directory, 1, extension, **kwargs)
+    return files[0] if files else None
 
 
-# Copy a file in the filesystem
-def copyFile(source, destination):
+# Return the paths of the k most recently modified files in a directory with
+# optional extension, newest first, or None if the directory can't be read.
+# Files are compared by st_ctime like os.path.getctime, using one stat call per
+# file in a single pass over the directory. If cache is set, the result is
+# reused until the directory's mtime changes, with the same settle time as the
+# listDirectory cache. Rewriting an existing file in place doesn't change the
+# directory's mtime, so cached results don't see that. If a ready
+# DirectoryIndex is given, directories under its root are looked up in the
+# index.
+def newestFiles(directory, k, extension="", cache=False, index=None):
+    if _useIndex(index, directory):
+        files = index.newestFiles(directory, k, extension)
+        if files is not None:
+            return files
+    key = (os.path.abspath(directory), extension, k)
     try:
-        shutil.copy(source, destination)
-    except shutil.SameFileError:
+        mtime = os.stat(directory).st_mtime_ns
+    except OSError:
+        newestFilesCache.pop(key, None)
+        return None
+    if cache:
+        cached = newestFilesCache.get(key)
+        if cached is not None and cached[0] == mtime:
+            return list(cached[1])
+    try:
+        with os.scandir(directory) as scan:
+            files = heapq.nlargest(k, _fileTimes(scan, extension))
+    except OSError:
+        return None
+    files = [path for _, path in files]
+    if cache:
+        if time.time_ns() - mtime >= directoryCacheSettle * 1e9:
+            newestFilesCache[key] = (mtime, files)
+        else:
+            newestFilesCache.pop(key, None)
+        files = list(files)
+    return files
+
+
+def _fileTimes(entries, extension):
+    for entry in entries:
+        if not entry.name.endswith(extension):
+            continue
+        try:
+            if entry.is_file():
+                yield entry.stat().st_ctime, entry.path
+        except OSError:
+            # removed since the directory was read
+            pass
+
+
+# Copy a file in the filesystem. Like shutil.copy, the destination can be a
+# directory, and the permission bits are copied. File data is copied in the
+# kernel with os.copy_file_range where the platform and filesystems support
+# it, or otherwise with os.sendfile, and falls back to reading and writing, in
+# copyChunkSize pieces. progress is called with (bytesDone, bytesTotal,
+# filesDone, filesTotal) after each piece. If the cancel event is set, copying
+# stops, the partial copy is removed and False is returned. Returns True once
+# the file is copied, or if source and destination are the same file.
+def copyFile(source, destination, progress=None, cancel=None):
+    if os.path.isdir(destination):
+        destination = os.path.join(destination, os.path.basename(source))
+    report = _copyProgress(progress, os.stat(source).st_size, 1)
+    invalidateReadCache(destination)
+    return _copyFile(source, destination, cancel, report)
+
+
+def _copyFile(source, destination, cancel, report, metadata=False):
+    if cancel is not None and cancel.is_set():
+        return False
+    try:
+        if os.path.samefile(source, destination):
+            report(0, 1)
+            return True
+    except OSError:
         pass
+    with open(source, "rb") as sourceFile, \
+            open(destination, "wb") as destinationFile:
+        completed = _copyFileData(sourceFile.fileno(),
+                                  destinationFile.fileno(), cancel, report)
+    if not completed:
+        os.remove(destination)
+        return False
+    if metadata:
+        shutil.copystat(source, destination)
+    else:
+        shutil.copymode(source, destination)
+    report(0, 1)
+    return True
+
+
+# Copy between file descriptors with the fastest method that works for them
+def _copyFileData(source, destination, cancel, report):
+    copied = 0
+    for method in (_copyFileRange, _sendFile, _readWrite):
+        try:
+            for size in method(source, destination, copied):
+                copied += size
+                report(size)
+                if cancel is not None and cancel.is_set():
+                    return False
+            return True
+        except OSError as error:
+            # only fall back before any data is copied by the method, which
+            # is when unsupported file systems fail
+            if copied or error.errno not in (errno.EXDEV, errno.ENOSYS,
+                                             errno.EINVAL, errno.EOPNOTSUPP,
+                                             errno.EBADF, errno.ENOTSUP):
+                raise
+    return True
+
+
+def _copyFileRange(source, destination, offset):
+    if not hasattr(os, "copy_file_range"):
+        raise OSError(errno.ENOSYS, "copy_file_range is not available")
+    while True:
+        size = os.copy_file_range(source, destination, copyChunkSize)
+        if not size:
+            if not offset and os.fstat(source).st_size:
+                # some file systems copy nothing instead of failing
+                raise OSError(errno.EINVAL, "copy_file_range copied nothing")
+            return
+        offset += size
+        yield size
+
+
+def _sendFile(source, destination, offset):
+    if not hasattr(os, "sendfile") or sys.platform == "win32":
+        raise OSError(errno.ENOSYS, "sendfile is not available")
+    while True:
+        size = os.sendfile(destination, source, offset, copyChunkSize)
+        if not size:
+            return
+        offset += size
+        yield size
+
+
+def _readWrite(source, destination, offset):
+    os.lseek(source, offset, os.SEEK_SET)
+    os.lseek(destination, offset, os.SEEK_SET)
+    while True:
+        data = os.read(source, copyChunkSize)
+        if not data:
+            return
+        view = memoryview(data)
+        while view:
+            written = os.write(destination, view)
+            view = view[written:]
+        yield len(data)
 
 
 # Move a file in the filesystem
 def moveFile(source, destination):
+    invalidateReadCache(source, destination)
     shutil.move(source, destination)
 
 
 # Delete a file from the filesystem
 def deleteFile(file):
     if pathExists(file):
+        invalidateReadCache(file)
         os.remove(file)
 
 
-# Read data from a file
-def readFile(file, lines=False, mode="r", encoding="utf8", **kwargs):
+# Return the cached result of read() for a file if the file hasn't changed
+# since it was cached, otherwise read and cache it. Unless shared is set, the
+# result is a copy made by copy, so callers can change it freely.
+def _cachedRead(function, file, args, shared, copy, read):
+    try:
+        stat = os.stat(file)
+    except (OSError, TypeError):
+        return read()
+    path = os.path.abspath(file)
+    key = (function, path, repr(sorted(args.items())))
+    signature = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+    with readCacheLock:
+        entry = readCache.get(key)
+        if entry is not None and entry[0] == signature:
+            readCache.move_to_end(key)
+            readCacheCounts["hits"] += 1
+            return entry[1] if shared else copy(entry[1])
+        readCacheCounts["misses"] += 1
+    data = read()
+    if data is None or stat.st_size > readCacheLimit or \
+            time.time_ns() - stat.st_mtime_ns < readCacheSettle * 1e9:
+        return data
+    with readCacheLock:
+        _dropReadCacheEntry(key)
+        readCache[key] = (signature, data, stat.st_size)
+        readCachePaths.setdefault(path, set()).add(key)
+        readCacheCounts["bytes"] += stat.st_size
+        while readCacheCounts["bytes"] > readCacheLimit:
+            _dropReadCacheEntry(next(iter(readCache)))
+            readCacheCounts["evictions"] += 1
+    return data if shared else copy(data)
+
+
+# Must be called with readCacheLock held
+def _dropReadCacheEntry(key):
+    entry = readCache.pop(key, None)
+    if entry is None:
+        return
+    readCacheCounts["bytes"] -= entry[2]
+    keys = readCachePaths[key[1]]
+    keys.discard(key)
+    if not keys:
+        del readCachePaths[key[1]]
+
+
+# Remove the cached contents of files, or of every file if none are given.
+# The write, copy, move and delete functions here do this for the files they
+# change.
+def invalidateReadCache(*files):
+    with readCacheLock:
+        if not files:
+            readCache.clear()
+            readCachePaths.clear()
+            readCacheCounts["bytes"] = 0
+            return
+        for file in files:
+            if file is None:
+                continue
+            for key in list(readCachePaths.get(os.path.abspath(file), ())):
+                _dropReadCacheEntry(key)
+
+
+# Return the read cache hit, miss and eviction counts, with the number of
+# entries and their total size in bytes
+def readCacheStats():
+    with readCacheLock:
+        return readCacheCounts | {"entries": len(readCache)}
+
+
+def _copyLines(data):
+    return list(data) if isinstance(data, list) else data
+
+
+# Copy the lists and dictionaries in parsed JSON data, and the NumPy arrays and
+# bytearrays that the pickle serializer can load, since those can be changed
+# in place. NumPy is only looked up, since its arrays can't exist unless it
+# was imported.
+def _copyJSON(data):
+    if isinstance(data, dict):
+        return {key: _copyJSON(value) for key, value in data.items()}
+    if isinstance(data, list):
+        return [_copyJSON(value) for value in data]
+    if isinstance(data, bytearray):
+        return bytearray(data)
+    numpy = sys.modules.get("numpy")
+    if numpy is not None and isinstance(data, numpy.ndarray):
+        return data.copy()
+    return data
+
+
+# Copy the rows of readCSV data. CSVTables have no methods that change them
+# and their numeric columns are read only, so they are shared.
+def _copyCSV(data):
+    if isinstance(data, dict):
+        return {key: dict(row) for key, row in data.items()}
+    if isinstance(data, list):
+        return [list(row) for row in data]
+    return data
+
+
+# Read data from a file. If mmap is set, the file is memory mapped read only
+# instead of being read, and the mapping is returned, or if lines is also set,
+# an iterator from mappedLines over it. Compressed files can't be mapped, so
+# their decompressed data is returned as bytes instead.
+# If cache is set, the result is cached (see readCache) and reused until the
+# file changes. Cached results are copied for each caller unless shared is set,
+# in which case every caller gets the same object and must not change it.
+# readJSON and readCSV cache the same way.
+def readFile(file, lines=False, mode="r", encoding="utf8", mmap=False,
+             cache=False, shared=False, **kwargs):
+    if cache and not mmap:
+        return _cachedRead("readFile", file,
+                           dict(kwargs, lines=lines, mode=mode,
+                                encoding=encoding),
+                           shared, _copyLines,
+                           lambda: readFile(file, lines, mode, encoding,
+                                            **kwargs))
     args = {key: kwargs[key] for key in validOpenArgs if key in kwargs}
     if not pathExists(file):
         return None
-    with open(file, mode=mode, encoding=encoding, **args) as fileObject:
+    if mmap:
+        buffer = _mapFileData(file)
+        return mappedLines(buffer) if lines else buffer
+    with _openFile(file, mode=mode, encoding=encoding, **args) as fileObject:
         if lines:
             data = fileObject.readlines()
         else:
@@ -134,91 +817,840 @@ def readFile(file, lines=False, mode="r", encoding="utf8", **kwargs):
     return data
 
 
-def writeFile(data, file, lines=False, mode="w", encoding="utf8", **kwargs):
+# Return whether a file is compressed, from its name.
+def isCompressed(file):
+    return os.path.splitext(file)[1].lower() in compressedOpeners
+
+
+# Open a file like open(), compressing or decompressing it if its name (or
+# compressedAs if given) has an extension from compressedOpeners. Compressed
+# files are opened in text mode unless mode has "b", with only the encoding,
+# errors and newline arguments. When writing, compressLevel sets the
+# compression level (the preset for .xz), and if compressThread is set, the
+# data is compressed by a ThreadedWriter's thread.
+def _openFile(file, mode="r", encoding=None, compressLevel=None,
+              compressThread=False, compressedAs=None, **args):
+    extension = os.path.splitext(compressedAs or file)[1].lower()
+    opener = compressedOpeners.get(extension)
+    if opener is None:
+        return open(file, mode=mode, encoding=encoding, **args)
+    writing = any(character in mode for character in "wax")
+    openerArgs = dict()
+    if "b" not in mode:
+        if "t" not in mode:
+            mode += "t"
+        openerArgs = {key: args[key] for key in ["errors", "newline"]
+                      if key in args}
+        openerArgs["encoding"] = encoding
+    if writing and compressLevel is not None:
+        openerArgs[compressLevelArgs[extension]] = compressLevel
+    fileObject = opener(file, mode, **openerArgs)
+    if writing and compressThread:
+        return ThreadedWriter(fileObject)
+    return fileObject
+
+
+# Memory map a file read only. The mapping can be sliced, searched and passed
+# anywhere a bytes-like object is accepted without copying the file, and should
+# be closed (or used in a with statement) when done. An empty file, which can't
+# be mapped, returns an empty memoryview. Returns None if the file doesn't
+# exist. Compressed files are mapped as they are, without decompressing them.
+def mapFile(file):
+    if not pathExists(file):
+        return None
+    with open(file, "rb") as fileObject:
+        if os.fstat(fileObject.fileno()).st_size == 0:
+            return memoryview(b"")
+        return MemoryMap(fileObject.fileno(), 0, access=ACCESS_READ)
+
+
+# Return a file's data for the mmap read paths: a memory mapping from mapFile,
+# or for compressed files, which can't be mapped, the decompressed data as
+# bytes. Returns None if the file doesn't exist.
+def _mapFileData(file):
+    if not isCompressed(file):
+        return mapFile(file)
+    if not pathExists(file):
+        return None
+    with _openFile(file, "rb") as fileObject:
+        return fileObject.read()
+
+
+# Return a memoryview of part of a memory mapped file without copying it. The
+# view must be released before the mapping can be closed.
+def mappedSlice(buffer, start=0, end=None):
+    return memoryview(buffer)[start:end]
+
+
+# Iterate over the lines of a memory mapped file as memoryviews that include
+# the line endings, without copying them.
+def mappedLines(buffer):
+    if not len(buffer):
+        return
+    view = memoryview(buffer)
+    start = 0
+    while start < len(buffer):
+        end = buffer.find(b"\n", start) + 1 or len(buffer)
+        yield view[start:end]
+        start = end
+
+
+# Iterate over the lines of a memory mapped file decoded as text the same way
+# reading it in text mode does, including universal newline translation. Only
+# mappedChunkSize bytes are decoded at a time.
+def _mappedTextLines(buffer, encoding="utf8", errors="strict"):
+    decoder = io.IncrementalNewlineDecoder(
+        codecs.getincrementaldecoder(encoding)(errors), translate=True)
+    partial = ""
+    for start in range(0, len(buffer), mappedChunkSize):
+        text = partial + decoder.decode(buffer[start:start +
+                                               mappedChunkSize])
+        lines = text.split("\n")
+        partial = lines.pop()
+        for line in lines:
+            yield line + "\n"
+    partial += decoder.decode(b"", final=True)
+    if partial:
+        yield partial
+
+
+# Write data to a file. If atomic is set, the data is written to a temporary
+# file in the same directory that then replaces the file, so readers never see
+# a partially written file. Files with compressed extensions are compressed
+# as they are written, with compressLevel and compressThread as for _openFile.
+def writeFile(data, file, lines=False, mode="w", encoding="utf8", atomic=False,
+              compressLevel=None, compressThread=False, **kwargs):
     args = {key: kwargs[key] for key in validOpenArgs if key in kwargs}
-    with open(file, mode=mode, encoding=encoding, **args) as fileObject:
+    args.update(compressLevel=compressLevel, compressThread=compressThread)
+    invalidateReadCache(file)
+    if atomic:
+        _writeFileAtomic(data, file, lines, mode, encoding, **args)
+        return
+    with _openFile(file, mode=mode, encoding=encoding, **args) as fileObject:
         if lines:
             fileObject.writelines(data)
         else:
             fileObject.write(data)
 
 
-# Read a json file
-def readJSON(file, **kwargs):
+# The temporary file name is unique to the process and thread, so concurrent
+# writers don't collide, and it's created with open() so it gets the same
+# permissions a new file would.
+def _writeFileAtomic(data, file, lines, mode, encoding, **args):
+    tempPath = "{}.{}.{}.tmp".format(file, os.getpid(), threading.get_ident())
+    try:
+        with _openFile(tempPath, mode=mode, encoding=encoding,
+                       compressedAs=file, **args) as fileObject:
+            if lines:
+                fileObject.writelines(data)
+            else:
+                fileObject.write(data)
+        if os.path.exists(file):
+            shutil.copymode(file, tempPath)
+        os.replace(tempPath, file)
+    except BaseException:
+        deleteFile(tempPath)
+        raise
+
+
+# Read a json file. If mmap is set, the text is decoded straight from a memory
+# mapping of the file. cache and shared work as they do for readFile, and only
+# the dictionaries, lists and arrays in copied results are copied (see
+# _copyJSON). If stream is set,
+# an iterator from iterJSON is returned instead. Files written with another
+# serializer are read by giving its name (see registerSerializer).
+def readJSON(file, mmap=False, cache=False, shared=False, stream=False,
+             serializer="stdlib", **kwargs):
+    if stream:
+        return iterJSON(file, **kwargs)
+    if cache:
+        return _cachedRead("readJSON", file,
+                           dict(kwargs, mmap=mmap, serializer=serializer),
+                           shared, _copyJSON,
+                           lambda: readJSON(file, mmap=mmap,
+                                            serializer=serializer, **kwargs))
+    if serializer != "stdlib":
+        return _readSerialized(file, serializer, mmap)
     args = {key: kwargs[key] for key in validJSONLoadsArgs if key in kwargs}
-    jsonText = readFile(file, **kwargs)
-    if jsonText is None:
-        return None
     try:
+        # compressed files can't be mapped, so they are read as text
+        if mmap and not isCompressed(file):
+            buffer = mapFile(file)
+            if buffer is None:
+                return None
+            with buffer:
+                jsonText = str(buffer, kwargs.get("encoding", "utf8"),
+                               kwargs.get("errors", "strict"))
+        else:
+            jsonText = readFile(file, **kwargs)
+        if jsonText is None:
+            return None
         data = json.loads(jsonText, **args)
-    except json.JSONDecodeError as error:
+    except (json.JSONDecodeError, UnicodeDecodeError) as error:
         warn(str(error), SyntaxWarning)
         return None
     return data
 
 
-# Write an object to a json file
-def writeJSON(obj, file, indent=4, **kwargs):
+# Read the elements of a top level JSON array, or the values of a JSON Lines
+# file (one value per line, ignoring blank lines), one at a time. Files are
+# read as JSON Lines if lines is set, as arrays if it is False, and otherwise
+# as found by _detectJSONLines. Only the value being parsed and about chunkSize
+# characters are held in memory. Returns None if the file doesn't exist.
+# Invalid JSON, including anything after the end of an array, gives a
+# SyntaxWarning and ends the iteration.
+def iterJSON(file, lines=None, encoding="utf8", chunkSize=jsonChunkSize,
+             **kwargs):
+    if not pathExists(file):
+        return None
+    return _iterJSON(file, lines, encoding, chunkSize, **kwargs)
+
+
+def _iterJSON(file, lines, encoding, chunkSize, **kwargs):
+    openArgs = {key: kwargs[key] for key in validOpenArgs if key in kwargs}
+    decoderArgs = {key: kwargs[key] for key in validJSONLoadsArgs
+                   if key in kwargs and key != "cls"}
+    decoder = kwargs.get("cls", json.JSONDecoder)(**decoderArgs)
+    with _openFile(file, encoding=encoding, **openArgs) as jsonFile:
+        if lines is None:
+            lines = _detectJSONLines(file, jsonFile, decoder, chunkSize)
+            if lines is None:
+                return
+            jsonFile.seek(0)
+        try:
+            if lines:
+                yield from _iterJSONLines(jsonFile, decoder)
+            else:
+                yield from _iterJSONArray(jsonFile, decoder, chunkSize)
+        except json.JSONDecodeError as error:
+            warn(str(error), SyntaxWarning)
+
+
+# Return whether a file holds JSON Lines rather than one JSON array, or None if
+# it has nothing but whitespace. Files with an extension from
+# jsonLinesExtensions (before any compressed extension) are JSON Lines, and so
+# are files that don't start with "[". A file that does is JSON Lines if
+# another value follows its first one in the first chunk, since JSON Lines
+# records can be arrays too. A first value longer than that is taken as an
+# array, so give lines for JSON Lines files with such long records.
+def _detectJSONLines(file, jsonFile, decoder, chunkSize):
+    name = os.path.splitext(file)[0] if isCompressed(file) else file
+    if os.path.splitext(name)[1].lower() in jsonLinesExtensions:
+        return True
+    start = ""
+    while not start:
+        text = jsonFile.read(chunkSize)
+        if not text:
+            return None
+        start = text.lstrip(" \t\n\r")
+    if not start.startswith("["):
+        return True
+    try:
+        _, end = decoder.raw_decode(start)
+    except json.JSONDecodeError:
+        return False
+    return bool(start[end:].strip(" \t\n\r"))
+
+
+def _iterJSONLines(jsonFile, decoder):
+    for number, line in enumerate(jsonFile, 1):
+        if line.strip():
+            try:
+                yield decoder.decode(line)
+            except json.JSONDecodeError as error:
+                raise json.JSONDecodeError("Line {}: {}".format(number,
+                                                                error.msg),
+                                           error.doc, error.pos) from None
+
+
+# Each element is parsed with raw_decode once the buffer holds it and the ","
+# or "]" after it, so a number cut off at the end of the buffer isn't taken as
+# complete. When more text is needed, at least as much as the
+# buffer holds is read, so an element that spans many reads is only parsed
+# about twice over.
+def _iterJSONArray(jsonFile, decoder, chunkSize):
+    buffer = ""
+    index = 0
+    end = False
+
+    def fill():
+        nonlocal buffer, index, end
+        text = jsonFile.read(max(chunkSize, len(buffer) - index))
+        end = not text
+        buffer = buffer[index:] + text
+        index = 0
+
+    def skipWhitespace():
+        nonlocal index
+        while True:
+            index = jsonWhitespace.match(buffer, index).end()
+            if index < len(buffer) or end:
+                return
+            fill()
+
+    # only whitespace may follow the array
+    def finish():
+        skipWhitespace()
+        if index < len(buffer):
+            raise json.JSONDecodeError("Extra data", buffer, index)
+
+    skipWhitespace()
+    if buffer[index:index + 1] != "[":
+        raise json.JSONDecodeError("Expecting '['", buffer, index)
+    index += 1
+    skipWhitespace()
+    if buffer[index:index + 1] == "]":
+        index += 1
+        finish()
+        return
+    while True:
+        try:
+            value, valueEnd = decoder.raw_decode(buffer, index)
+            delimiter = jsonWhitespace.match(buffer, valueEnd).end()
+        except json.JSONDecodeError:
+            if end:
+                raise
+            fill()
+            continue
+        character = buffer[delimiter:delimiter + 1]
+        if character not in (",", "]"):
+            # a number cut off in its fraction or exponent parses up to there
+            if not end:
+                fill()
+                continue
+            raise json.JSONDecodeError("Expecting ',' delimiter", buffer,
+                                       delimiter)
+        yield value
+        index = delimiter + 1
+        if character == "]":
+            finish()
+            return
+        skipWhitespace()
+
+
+# Write an object to a json file. If another serializer is named, the object
+# is written with it instead, as bytes, and only indent and the writeFile
+# arguments are used.
+def writeJSON(obj, file, indent=4, serializer="stdlib", **kwargs):
+    if serializer != "stdlib":
+        dumps, _ = _serializer(serializer)
+        data = dumps(obj, indent=indent)
+        writeFile(data, file, **dict(kwargs, lines=isinstance(data, list),
+                                     mode="wb", encoding=None))
+        return
     args = {key: kwargs[key] for key in validJSONDumpsArgs if key in kwargs}
     writeFile(json.dumps(obj, indent=indent, **args), file, **kwargs)
 
 
+# Add a serializer that readJSON, writeJSON and the settings functions can use
+# by name. dumps(obj, indent) returns bytes, or a list of bytes-like pieces
+# that are written in order, and loads takes a bytes-like object (a bytearray,
+# or a memoryview of a memory mapping when readJSON is given mmap) and raises
+# ValueError if the data can't be loaded. These are registered here:
+#   "stdlib"  the json module, which readJSON and writeJSON use directly
+#   "orjson"  orjson, if it is installed, with indent 2 for any indent
+#   "json"    orjson if it is installed, otherwise compact stdlib JSON
+#   "pickle"  pickle protocol 5, with buffers like numpy array data kept out
+#             of band so they aren't copied. Loading a pickle can run any
+#             code, so it must only be used for trusted local files.
+def registerSerializer(name, dumps, loads):
+    serializers[name] = (dumps, loads)
+
+
+def _serializer(name):
+    if name not in serializers:
+        raise ValueError("unknown serializer: {}".format(name))
+    return serializers[name]
+
+
+# Read a file with a registered serializer. Without mmap, the file is read
+# into a bytearray, so buffers loaded out of band are writable. With mmap,
+# they are read only views of the mapping, which stays open while they exist.
+def _readSerialized(file, serializer, mmap):
+    _, loads = _serializer(serializer)
+    if mmap:
+        data = _mapFileData(file)
+        if data is not None:
+            data = memoryview(data)
+    else:
+        data = _readBuffer(file)
+    if data is None:
+        return None
+    try:
+        return loads(data)
+    except ValueError as error:
+        warn(str(error), SyntaxWarning)
+        return None
+
+
+# Read a whole file into a bytearray, or return None if it doesn't exist
+def _readBuffer(file):
+    if not pathExists(file):
+        return None
+    with _openFile(file, mode="rb") as fileObject:
+        if isCompressed(file):
+            return bytearray(fileObject.read())
+        data = bytearray(os.fstat(fileObject.fileno()).st_size)
+        del data[fileObject.readinto(data):]
+        # the file may have grown since it was opened
+        data += fileObject.read()
+    return data
+
+
+def _stdlibDumps(obj, indent=None):
+    return json.dumps(obj, indent=indent).encode("utf8")
+
+
+def _stdlibLoads(data):
+    return json.loads(str(data, "utf8"))
+
+
+def _compactJSONDumps(obj, indent=None):
+    return json.dumps(obj, separators=(",", ":")).encode("utf8")
+
+
+# Keys that aren't strings are converted to strings like the json module
+# does, and numpy arrays are written as lists.
+def _orjsonDumps(obj, indent=None):
+    options = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+    if indent:
+        options |= orjson.OPT_INDENT_2
+    return orjson.dumps(obj, option=options)
+
+
+# A pickle file is pickleMagic, the number of out of band buffers, the pickle
+# size and each buffer's size as 8 byte little endian integers, then each
+# buffer and the pickle, each starting at a multiple of pickleAlignment bytes.
+# Buffers that aren't contiguous are pickled in band.
+def _pickleDumps(obj, indent=None):
+    buffers = []
+
+    def keepOutOfBand(buffer):
+        try:
+            buffers.append(buffer.raw())
+        except BufferError:
+            return True
+        return False
+
+    data = pickle.dumps(obj, protocol=5, buffer_callback=keepOutOfBand)
+    sizes = [buffer.nbytes for buffer in buffers]
+    pieces = [pickleMagic + struct.pack("<{}Q".format(len(sizes) + 2),
+                                        len(sizes), len(data), *sizes)]
+    offset = len(pieces[0])
+    for piece in buffers + [data]:
+        padding = -offset % pickleAlignment
+        pieces += [bytes(padding), piece]
+        offset += padding + len(piece)
+    return pieces
+
+
+def _pickleLoads(data):
+    view = memoryview(data).cast("B")
+    if view[:len(pickleMagic)] != pickleMagic:
+        raise ValueError("not a pickle serializer file")
+    try:
+        count, size = struct.unpack_from("<QQ", view, len(pickleMagic))
+        sizes = struct.unpack_from("<{}Q".format(count), view,
+                                   len(pickleMagic) + 16)
+        offset = len(pickleMagic) + 16 + 8 * count
+        buffers = []
+        for bufferSize in sizes + (size,):
+            offset += -offset % pickleAlignment
+            if offset + bufferSize > len(view):
+                raise ValueError("pickle serializer file is truncated")
+            buffers.append(view[offset:offset + bufferSize])
+            offset += bufferSize
+        return pickle.loads(buffers.pop(), buffers=buffers)
+    except (struct.error, EOFError, pickle.UnpicklingError) as error:
+        raise ValueError(str(error)) from None
+
+
+registerSerializer("stdlib", _stdlibDumps, _stdlibLoads)
+registerSerializer("pickle", _pickleDumps, _pickleLoads)
+if orjson is not None:
+    registerSerializer("orjson", _orjsonDumps, orjson.loads)
+    registerSerializer("json", _orjsonDumps, orjson.loads)
+else:
+    registerSerializer("json", _compactJSONDumps, _stdlibLoads)
+
+
+# Open a JSONLWriter that appends records to a JSON Lines file through a
+# buffer flushed by a background thread. Keyword arguments are passed to
+# JSONLWriter. The writer should be closed when done.
+def openJSONL(file, **kwargs):
+    return JSONLWriter(file, **kwargs)
+
+
 # Read a CSV spreadsheet into an array of rows, each an array of cells.
 # Alternatively, read it into a dictionary keyed by the values in the
 # indexRow, containing dictionaries keyed by the values in the header row.
 # If there are duplicate values for keys, the keys will be suffixed with
-# [<integer>].
-def readCSV(file, useDict=False, indexRow=0, **kwargs):
-    args = {key: kwargs[key] for key in validCSVArgs if key in kwargs}
-    csvData = []
-    csvLines = readFile(file, lines=True, **kwargs)
-    if csvLines is None:
+# [<integer>]. If stream is set, the file is read lazily and an iterator from
+# iterCSV is returned instead. If columnar is set, a CSVTable holding each
+# column as a typed array is returned, with column types given by dtypes.
+# If workers is not 1, the file is parsed by readCSVParallel with that many
+# worker processes (None for one per CPU). cache and shared work as they do
+# for readFile, except that streams aren't cached and CSVTables are always
+# shared.
+def readCSV(file, useDict=False, indexRow=0, stream=False, columnar=False,
+            dtypes=None, workers=1, chunkSize=csvChunkSize, cache=False,
+            shared=False, **kwargs):
+    if cache and not stream:
+        return _cachedRead("readCSV", file,
+                           dict(kwargs, useDict=useDict, indexRow=indexRow,
+                                columnar=columnar, dtypes=dtypes),
+                           shared, _copyCSV,
+                           lambda: readCSV(file, useDict, indexRow,
+                                           columnar=columnar, dtypes=dtypes,
+                                           workers=workers,
+                                           chunkSize=chunkSize, **kwargs))
+    if columnar:
+        return _readCSVColumnar(file, indexRow, dtypes, **kwargs)
+    if workers != 1 and not stream:
+        return readCSVParallel(file, useDict=useDict, indexRow=indexRow,
+                               workers=workers, chunkSize=chunkSize, **kwargs)
+    csvRows = iterCSV(file, useDict=useDict, indexRow=indexRow, **kwargs)
+    if csvRows is None or stream:
+        return csvRows
+    if useDict:
+        return dict(csvRows)
+    return list(csvRows)
+
+
+def _readCSVColumnar(file, indexRow, dtypes, **kwargs):
+    # imported here since CSVTable uses the key rules from this module
+    from .CSVTable import CSVTable
+    csvRows = iterCSV(file, **kwargs)
+    if csvRows is None:
         return None
-    csvReader = csv.reader(csvLines, **args)
-    for row in csvReader:
-        csvData.append(row)
-    if not useDict:
-        return csvData
-    headers = []
-    csvDict = dict()
-    for row in csvData:
-        if not headers:
+    try:
+        return CSVTable.fromRows(csvRows, indexRow=indexRow, dtypes=dtypes)
+    except ValueError as error:
+        warn(str(error), SyntaxWarning)
+        return None
+
+
+# Read a CSV spreadsheet one row at a time, yielding each row as an array of
+# cells. If useDict is set, (rowID, rowDict) pairs are yielded instead, with
+# the same header and duplicate key rules as readCSV, so passing the iterator
+# to dict() gives the same result as readCSV. Only the current row and the set
+# of row IDs already used are held in memory. Returns None if the file doesn't
+# exist. If mmap is set, the rows are parsed straight from a memory mapping of
+# the file.
+def iterCSV(file, useDict=False, indexRow=0, mode="r", encoding="utf8",
+            mmap=False, **kwargs):
+    if not pathExists(file):
+        return None
+    return _iterCSV(file, useDict, indexRow, mode, encoding, mmap, **kwargs)
+
+
+def _iterCSV(file, useDict, indexRow, mode, encoding, mmap, **kwargs):
+    openArgs = {key: kwargs[key] for key in validOpenArgs if key in kwargs}
+    csvArgs = {key: kwargs[key] for key in validCSVArgs if key in kwargs}
+    # other newline modes aren't translated by _mappedTextLines, and
+    # compressed files are read as a stream instead
+    if mmap and openArgs.get("newline") is None and not isCompressed(file):
+        csvFile = mapFile(file)
+        csvLines = _mappedTextLines(csvFile, encoding,
+                                    openArgs.get("errors", "strict"))
+    else:
+        csvFile = _openFile(file, mode=mode, encoding=encoding, **openArgs)
+        csvLines = csvFile
+    with csvFile:
+        csvReader = csv.reader(csvLines, **csvArgs)
+        if useDict:
+            yield from _csvRowDicts(csvReader, indexRow)
+        else:
+            yield from csvReader
+
+
+# Generate (rowID, rowDict) pairs from an iterable of CSV rows, using the
+# first row as the header row. Header names are resolved once for the longest
+# row seen so far and reused for every row.
+def _csvRowDicts(csvRows, indexRow=0):
+    headers = None
+    headerNames = []
+    usedHeaders = set()
+    headerCounters = dict()
+    rowIDs = set()
+    rowIDCounters = dict()
+    for row in csvRows:
+        if headers is None:
             headers = row
-        rowID = row[indexRow]
-        rowIDsubscript = 0
-        while rowID in csvDict:
-            rowID = row[indexRow] + "[{}]".format(rowIDsubscript)
-            # rowID = row[indexRow] + "[" + str(rowIDsubscript) + "]"
-            rowIDsubscript += 1
-        rowDict = dict()
-        dummyHeader = "unknownHeader"
-        dummySubscript = 0
-        for index in range(len(row)):
-            if index >= len(headers):
-                while True:
-                    header = dummyHeader + "[{}]".format(dummySubscript)
-                    # header = dummyHeader + "[" + str(dummySubscript) + "]"
-                    dummySubscript += 1
-                    if header not in rowDict:
-                        break
+        rowID = _uniqueKey(row[indexRow], rowIDs, rowIDCounters)
+        while len(headerNames) < len(row):
+            index = len(headerNames)
+            if index < len(headers):
+                header = _uniqueKey(headers[index], usedHeaders,
+                                    headerCounters)
             else:
-                header = headers[index]
-                headerSubscript = 0
-                while header in rowDict:
-                    header = headers[index] + "[{}]".format(headerSubscript)
-                    # header = headers[index] + "[" + str(headerSubscript) + "]"
-                    headerSubscript += 1
-            rowDict[header] = row[index]
-        csvDict[rowID] = rowDict
-    return csvDict
+                header = _uniqueKey("unknownHeader", usedHeaders,
+                                    headerCounters, alwaysSuffix=True)
+            headerNames.append(header)
+        yield rowID, dict(zip(headerNames, row))
+
+
+# Return key, or key suffixed with [<integer>] if it is already in usedKeys,
+# and add the result to usedKeys. counters holds the next subscript to try for
+# each key, since every lower subscript is known to be taken, which keeps
+# resolving many duplicates of the same key linear.
+def _uniqueKey(key, usedKeys, counters, alwaysSuffix=False):
+    uniqueKey = key
+    if alwaysSuffix or uniqueKey in usedKeys:
+        subscript = counters.get(key, 0)
+        while True:
+            uniqueKey = key + "[{}]".format(subscript)
+            subscript += 1
+            if uniqueKey not in usedKeys:
+                break
+        counters[key] = subscript
+    usedKeys.add(uniqueKey)
+    return uniqueKey
+
+
+# Read a CSV spreadsheet like readCSV, parsing it in worker processes. The file
+# is split into chunks of about chunkSize bytes at newlines outside quoted
+# fields, and the rows of each chunk are joined back in file order, so the
+# result is the same as readCSV. Each chunk is checked to have ended outside a
+# quoted field, and if one didn't (which can only happen with stray quote
+# characters inside unquoted fields), the file is read with readCSV instead.
+# Files that fit in one chunk, that are compressed, or that can't be split on
+# quote and newline bytes (an escapechar is set, or the encoding isn't ASCII
+# compatible), are also read with readCSV.
+def readCSVParallel(file, useDict=False, indexRow=0, workers=None,
+                    chunkSize=csvChunkSize, encoding="utf8", **kwargs):
+    if not pathExists(file):
+        return None
+    openArgs = {key: kwargs[key] for key in ["errors", "newline"]
+                if key in kwargs}
+    csvArgs = {key: kwargs[key] for key in validCSVArgs if key in kwargs}
+    quote = _csvQuoteBytes(encoding, **csvArgs)
+    if quote is None or workers == 1 or isCompressed(file) or \
+            os.path.getsize(file) <= chunkSize:
+        return readCSV(file, useDict=useDict, indexRow=indexRow,
+                       encoding=encoding, **kwargs)
+    boundaries = _csvChunkBoundaries(file, quote, chunkSize)
+    sentinels = [csvChunkSentinel] * (len(boundaries) - 2) + [None]
+    with ProcessPoolExecutor(workers) as executor:
+        chunks = list(executor.map(_readCSVChunk, repeat(file),
+                                   boundaries[:-1], boundaries[1:], sentinels,
+                                   repeat(encoding), repeat(openArgs),
+                                   repeat(csvArgs)))
+    if None in chunks:
+        return readCSV(file, useDict=useDict, indexRow=indexRow,
+                       encoding=encoding, **kwargs)
+    csvRows = chain.from_iterable(chunks)
+    if useDict:
+        return dict(_csvRowDicts(csvRows, indexRow))
+    return list(csvRows)
+
+
+# Return the quote character of the CSV dialect encoded as bytes, b"" if
+# quoting is disabled, or None if records can't be found by looking for quote
+# and newline bytes.
+def _csvQuoteBytes(encoding, **csvArgs):
+    dialect = csv.reader([], **csvArgs).dialect
+    if dialect.escapechar is not None:
+        return None
+    quote = "" if dialect.quoting == csv.QUOTE_NONE else dialect.quotechar
+    text = quote + "\n"
+    try:
+        encoded = text.encode(encoding)
+    except UnicodeEncodeError:
+        return None
+    # a utf-8-sig byte order mark only appears at the start of the file
+    if not text.isascii() or \
+            encoded.removeprefix(codecs.BOM_UTF8) != text.encode("ascii"):
+        return None
+    return quote.encode("ascii")
+
+
+# Return the byte offsets that split a CSV file into chunks of about chunkSize
+# bytes at record boundaries, starting with 0 and ending with the file size.
+# Newlines are record boundaries when an even number of quotes precede them.
+def _csvChunkBoundaries(file, quote, chunkSize):
+    boundaries = [0]
+    position = 0
+    inQuotes = False
+    with open(file, "rb") as csvFile:
+        while block := csvFile.read(chunkSize):
+            if quote:
+                inQuotes ^= bool(block.count(quote) & 1)
+            # walk back from the end of the block to the last newline that
+            # is outside a quoted field
+            blockInQuotes = inQuotes
+            end = len(block)
+            while (newline := block.rfind(b"\n", 0, end)) >= 0:
+                if quote:
+                    blockInQuotes ^= bool(block.count(quote, newline + 1,
+                                                      end) & 1)
+                if not blockInQuotes:
+                    boundaries.append(position + newline + 1)
+                    break
+                end = newline
+            position += len(block)
+    if boundaries[-1] != position:
+        boundaries.append(position)
+    return boundaries
+
+
+# Parse the rows of a CSV file between the start and end byte offsets in a
+# worker process. If sentinel is set, it is parsed after the chunk to check
+# that the chunk ended outside a quoted field, and None is returned if it
+# didn't.
+def _readCSVChunk(file, start, end, sentinel, encoding, openArgs, csvArgs):
+    with open(file, "rb") as csvFile:
+        csvFile.seek(start)
+        data = csvFile.read(end - start)
+    csvLines = io.TextIOWrapper(io.BytesIO(data), encoding=encoding,
+                                **openArgs)
+    if sentinel is None:
+        return list(csv.reader(csvLines, **csvArgs))
+    csvRows = list(csv.reader(chain(csvLines, [sentinel]), **csvArgs))
+    if not csvRows or csvRows.pop() != next(csv.reader([sentinel],
+                                                        **csvArgs)):
+        return None
+    return csvRows
+
+
+# Read count rows of a CSV file starting at row start (the header row is row
+# 0) without parsing the rows before it. A row offset index is built on first
+# use and saved next to the file by indexCSV, so later calls seek straight to
+# the nearest indexed row. Returns an empty list past the end of the file, or
+# None if the file doesn't exist. If the file can't be indexed, the rows are
+# found by reading the file from the start.
+def readCSVRows(file, start, count=1, encoding="utf8", **kwargs):
+    index = indexCSV(file, encoding=encoding, **kwargs)
+    if index is None:
+        csvRows = iterCSV(file, encoding=encoding, **kwargs)
+        if csvRows is None:
+            return None
+        return list(islice(csvRows, start, start + count))
+    if start >= index["rows"]:
+        return []
+    openArgs = {key: kwargs[key] for key in ["errors", "newline"]
+                if key in kwargs}
+    csvArgs = {key: kwargs[key] for key in validCSVArgs if key in kwargs}
+    skip = start % index["stride"]
+    with open(file, "rb") as csvFile:
+        csvFile.seek(index["offsets"][start // index["stride"]])
+        with io.TextIOWrapper(csvFile, encoding=encoding,
+                              **openArgs) as csvLines:
+            csvReader = csv.reader(csvLines, **csvArgs)
+            return list(islice(csvReader, skip, skip + count))
+
+
+# Return the number of rows in a CSV file, including the header row, from its
+# row offset index, or None if the file doesn't exist or can't be indexed.
+# Compressed files are counted by reading them.
+def csvRowCount(file, **kwargs):
+    if isCompressed(file):
+        csvRows = iterCSV(file, **kwargs)
+        if csvRows is None:
+            return None
+        return sum(1 for _ in csvRows)
+    index = indexCSV(file, **kwargs)
+    if index is None:
+        return None
+    return index["rows"]
+
+
+# Return the path of the row offset index file for a CSV file.
+def csvIndexPath(file):
+    return file + csvIndexSuffix
+
+
+# Return the row offset index of a CSV file, which holds the byte offset of
+# every stride'th row. The index is kept in memory, and saved to the file from
+# csvIndexPath. Both are rebuilt when the CSV file's mtime or size changes.
+# Rows are found with the same rule as readCSVParallel (newlines preceded by
+# an even number of quotes), so quote characters should only appear in quoted
+# fields, as written by writeCSV. Returns None if the file doesn't exist, is
+# compressed, or can't be split on quote and newline bytes.
+def indexCSV(file, stride=csvIndexStride, encoding="utf8", **kwargs):
+    csvArgs = {key: kwargs[key] for key in validCSVArgs if key in kwargs}
+    quote = _csvQuoteBytes(encoding, **csvArgs)
+    if quote is None or isCompressed(file) or not pathExists(file):
+        return None
+    status = os.stat(file)
+    key = (os.path.abspath(file), quote)
+    index = csvIndexes.get(key)
+    if not _csvIndexValid(index, status):
+        index = _readCSVIndex(file, quote)
+    if not _csvIndexValid(index, status):
+        index = _buildCSVIndex(file, quote, stride, status)
+        _writeCSVIndex(file, index)
+    csvIndexes[key] = index
+    return index
+
+
+def _csvIndexValid(index, status):
+    return index is not None and index["mtime"] == status.st_mtime_ns and \
+        index["size"] == status.st_size
+
+
+def _buildCSVIndex(file, quote, stride, status):
+    offsets = array("Q", [0])
+    rows = 0
+    offset = 0
+    inQuotes = False
+    with open(file, "rb") as csvFile:
+        for line in csvFile:
+            offset += len(line)
+            if quote and line.count(quote) & 1:
+                inQuotes = not inQuotes
+            if not inQuotes:
+                rows += 1
+                if rows % stride == 0:
+                    offsets.append(offset)
+    return {"mtime": status.st_mtime_ns, "size": status.st_size,
+            "stride": stride, "rows": rows, "quote": quote,
+            "offsets": offsets}
+
+
+def _readCSVIndex(file, quote):
+    data = readFile(csvIndexPath(file), mode="rb", encoding=None)
+    if data is None or len(data) < csvIndexHeader.size:
+        return None
+    magic, mtime, size, stride, rows, quoteByte = \
+        csvIndexHeader.unpack_from(data)
+    if magic != csvIndexMagic or quoteByte != (quote[0] if quote else 0):
+        return None
+    offsets = array("Q")
+    offsets.frombytes(data[csvIndexHeader.size:])
+    if sys.byteorder == "big":
+        offsets.byteswap()
+    return {"mtime": mtime, "size": size, "stride": stride, "rows": rows,
+            "quote": quote, "offsets": offsets}
+
+
+# The index is written to a temporary file and moved into place so readers
+# never see a partial index. A CSV file in a read only directory just keeps
+# its index in memory.
+def _writeCSVIndex(file, index):
+    offsets = array("Q", index["offsets"])
+    if sys.byteorder == "big":
+        offsets.byteswap()
+    header = csvIndexHeader.pack(csvIndexMagic, index["mtime"], index["size"],
+                                 index["stride"], index["rows"],
+                                 index["quote"][0] if index["quote"] else 0)
+    try:
+        writeFile(header + offsets.tobytes(), csvIndexPath(file), mode="wb",
+                  encoding=None, atomic=True)
+    except OSError:
+        pass
 
 
 # Write a CSV file from the given csvData. If it is a dictionary, only the
-# values will be written.
-def writeCSV(data, file, mode="w", encoding="utf8", **kwargs):
+# values will be written. Compressed files work as they do for writeFile.
+def writeCSV(data, file, mode="w", encoding="utf8", compressLevel=None,
+             compressThread=False, **kwargs):
     openArgs = {key: kwargs[key] for key in validOpenArgs if key in kwargs}
     csvArgs = {key: kwargs[key] for key in validCSVArgs if key in kwargs}
-    with open(file, mode=mode, encoding=encoding, **openArgs) as csvFile:
+    invalidateReadCache(file)
+    with _openFile(file, mode=mode, encoding=encoding,
+                   compressLevel=compressLevel, compressThread=compressThread,
+                   **openArgs) as csvFile:
         csvWriter = csv.writer(csvFile, **csvArgs)
         if isinstance(data, dict):
             for row in data.values():
@@ -229,87 +1661,642 @@ def writeCSV(data, file, mode="w", encoding="utf8", **kwargs):
 
 
 # Run a shell command. By default, process output is set to redirect to
-# sys.stdout in realtime. This helps ensure any redirection of sys.stdout will
-# capture it.
+# sys.stdout (and sys.stderr for a separate stderr pipe) in realtime. This
+# helps ensure any redirection of sys.stdout will capture it. If output is
+# False, the output is returned instead, with stdout and stderr in the order it
+# was read. If callback is set, it is called with each (stream, data) pair from
+# iterShellCmd as the output arrives. If spool is also set, the output is
+# captured in a tempfile.SpooledTemporaryFile that keeps up to spool bytes (or
+# characters in text mode) in memory and moves to a file on disk beyond that,
+# and the file, rewound to the start, is returned instead of a string. The
+# caller should close it when done.
+# If persistent is set, the command is run by a shared CommandServer instead of
+# a new process (except on Windows, which has no POSIX shell). Its output is
+# always captured with stderr included, and is delivered once the command
+# finishes. Only timeout is supported there, so the command runs in a new
+# process as usual if stdout, stderr, spool or any other process arguments
+# (like cwd, env or cancel) are given.
 def shellCmd(command, output=True, stdout=subprocess.PIPE,
-             stderr=subprocess.STDOUT, text=True, **kwargs):
-    # Windows specific flags to prevent shell windows from appearing
-    startupInfo = subprocess.STARTUPINFO()
-    startupInfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-    with (subprocess.Popen(shlex.split(command), stdout=stdout, stderr=stderr,
-                          text=text, startupinfo=startupInfo, **kwargs)
-          as process):
-        outText = ""
-        while True:
-            if stdout == subprocess.PIPE:
-                out = process.stdout.readline()
-                if output:
-                    sys.stdout.write(out)
-                else:
-                    outText += out
+             stderr=subprocess.STDOUT, text=True, callback=None, spool=None,
+             persistent=False, **kwargs):
+    if persistent and _persistentShellCmdSupported(stdout, stderr, spool,
+                                                   kwargs):
+        return _persistentShellCmd(command, output, text, callback,
+                                   kwargs.get("timeout"))
+    outText = []
+    if not output and spool is not None:
+        outText = tempfile.SpooledTemporaryFile(
+            max_size=spool, mode="w+" if text else "w+b",
+            encoding="utf8" if text else None, newline="" if text else None)
+    returnCode = None
+    for stream, data in iterShellCmd(command, stdout=stdout, stderr=stderr,
+                                     text=text, **kwargs):
+        if stream == "returncode":
+            returnCode = data
+            continue
+        if callback is not None:
+            callback(stream, data)
+        if not output:
+            if spool is None:
+                outText.append(data)
             else:
-                out = ""
-            if len(out) == 0 and process.poll() is not None:
-                break
-        # no way to properly integrate stdout output with stderr in
-        # chronological order so just dump  stderr afterward
+                outText.write(data)
+        elif stream == "stdout":
+            sys.stdout.write(data)
+        else:
+            sys.stderr.write(data)
+    if not output and spool is not None:
+        outText.seek(0)
+        return returnCode, outText
+    return returnCode, ("" if text else b"").join(outText)
+
+
+def _persistentShellCmdSupported(stdout, stderr, spool, kwargs):
+    return sys.platform != "win32" and stdout == subprocess.PIPE and \
+        stderr == subprocess.STDOUT and spool is None and \
+        all(value is None for key, value in kwargs.items() if key != "timeout")
+
+
+def _persistentShellCmd(command, output, text, callback, timeout):
+    global commandServer
+    if commandServer is None:
+        commandServer = CommandServer()
+        atexit.register(commandServer.close)
+    returnCode, outText = commandServer.run(command, text=text,
+                                            timeout=timeout)
+    if callback is not None and outText:
+        callback("stdout", outText)
+    if output:
+        (sys.stdout if text else sys.stdout.buffer).write(outText)
+        outText = "" if text else b""
+    return returnCode, outText
+
+
+# Run a shell command and iterate over its output as it arrives. Piped stdout
+# and stderr are read together in chunks of up to chunkSize bytes as soon as
+# either has data, and yielded as ("stdout", data) or ("stderr", data) pairs in
+# the order they were read, decoded to text with universal newlines if text is
+# set. Once the process has exited, ("returncode", returncode) is yielded. If
+# the iterator is closed early, the process is killed. The process is also
+# killed if it runs longer than timeout seconds, or if cancel (a
+# threading.Event) is set, and then the return code is None.
+def iterShellCmd(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                 text=True, chunkSize=65536, timeout=None, cancel=None,
+                 **kwargs):
+    encoding = kwargs.pop("encoding", None) or \
+        locale.getpreferredencoding(False)
+    errors = kwargs.pop("errors", None) or "strict"
+    kwargs.pop("universal_newlines", None)
+    kwargs.setdefault("bufsize", 0)
+    if sys.platform == "win32":
+        # Windows specific flags to prevent shell windows from appearing
+        startupInfo = subprocess.STARTUPINFO()
+        startupInfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+        kwargs.setdefault("startupinfo", startupInfo)
+    with subprocess.Popen(shlex.split(command), stdout=stdout, stderr=stderr,
+                          **kwargs) as process:
+        pipes = dict()
+        if stdout == subprocess.PIPE:
+            pipes[process.stdout.fileno()] = "stdout"
         if stderr == subprocess.PIPE:
-            err = process.stderr.read()
-            if output:
-                sys.stderr.write(err)
+            pipes[process.stderr.fileno()] = "stderr"
+        decoders = {stream: io.IncrementalNewlineDecoder(
+            codecs.getincrementaldecoder(encoding)(errors), translate=True)
+            for stream in pipes.values()}
+        stopped = _shellCmdStopped(timeout, cancel)
+        interval = None if stopped is None else shellPollInterval
+        killed = False
+        completed = False
+        try:
+            for stream, data in _readPipes(pipes, chunkSize, stopped):
+                if text:
+                    data = decoders[stream].decode(data, final=not data)
+                if data:
+                    yield stream, data
+            if stopped is None:
+                process.wait()
+            while stopped is not None and process.poll() is None:
+                if stopped():
+                    break
+                try:
+                    process.wait(interval)
+                except subprocess.TimeoutExpired:
+                    pass
             else:
-                outText += err
-        return process.returncode, outText
+                completed = True
+        finally:
+            # the process is only killed if the iterator was closed early or
+            # failed, or it timed out or was cancelled, since pipes can reach
+            # EOF (or not be piped at all) before it has exited. A process
+            # that exited by itself in the meantime keeps its return code.
+            if not completed and process.poll() is None:
+                process.kill()
+                killed = True
+        process.wait()
+    yield "returncode", None if killed else process.returncode
+
+
+# Return a function that checks whether a shell command has timed out or been
+# cancelled, or None if neither can happen.
+def _shellCmdStopped(timeout, cancel):
+    if timeout is None and cancel is None:
+        return None
+    deadline = None if timeout is None else time.monotonic() + timeout
+
+    def stopped():
+        return (cancel is not None and cancel.is_set()) or \
+            (deadline is not None and time.monotonic() >= deadline)
+
+    return stopped
+
+
+# Read from pipe file descriptors as data arrives, yielding (stream, data)
+# pairs, with empty data when a pipe is closed. If stopped is set, it is
+# checked every shellPollInterval seconds, and reading stops when it returns
+# True. Pipes can't be used with selectors on Windows, so threads read them
+# there instead.
+def _readPipes(pipes, chunkSize, stopped=None):
+    if sys.platform == "win32":
+        yield from _readPipesThreaded(pipes, chunkSize, stopped)
+        return
+    interval = None if stopped is None else shellPollInterval
+    with selectors.DefaultSelector() as selector:
+        for pipe, stream in pipes.items():
+            selector.register(pipe, selectors.EVENT_READ, stream)
+        while selector.get_map():
+            if stopped is not None and stopped():
+                return
+            for key, _ in selector.select(interval):
+                data = os.read(key.fd, chunkSize)
+                if not data:
+                    selector.unregister(key.fd)
+                yield key.data, data
+
+
+def _readPipesThreaded(pipes, chunkSize, stopped=None):
+    interval = None if stopped is None else shellPollInterval
+    chunks = queue.Queue()
+
+    def readPipe(pipe, stream):
+        while True:
+            data = os.read(pipe, chunkSize)
+            chunks.put((stream, data))
+            if not data:
+                break
+
+    for pipe, stream in pipes.items():
+        threading.Thread(target=readPipe, args=(pipe, stream),
+                         daemon=True).start()
+    openPipes = len(pipes)
+    while openPipes:
+        if stopped is not None and stopped():
+            return
+        try:
+            stream, data = chunks.get(timeout=interval)
+        except queue.Empty:
+            continue
+        if not data:
+            openPipes -= 1
+        yield stream, data
+
+
+# Run a list of shell commands with shellCmd, with at most workers of them
+# running at once (one per CPU for None), and capture each command's output
+# separately. Each command is killed if it runs longer than timeout seconds.
+# If cancel (a threading.Event) is set, running commands are killed and the
+# rest aren't started. Results are (returncode, output) pairs as from
+# shellCmd(output=False), with a returncode of None for commands that timed
+# out, were cancelled or couldn't be started. If ordered is set, a list of
+# results in the order of the commands is returned, otherwise an iterator of
+# (index, result) pairs in the order the commands finish. Closing that iterator
+# early cancels the remaining commands.
+def shellCmdBatch(commands, workers=None, timeout=None, cancel=None,
+                  ordered=True, **kwargs):
+    results = _shellCmdBatch(commands, workers, timeout, cancel, **kwargs)
+    if not ordered:
+        return results
+    batch = [None] * len(commands)
+    for index, result in results:
+        batch[index] = result
+    return batch
+
+
+def _shellCmdBatch(commands, workers, timeout, cancel, **kwargs):
+    if cancel is None:
+        cancel = threading.Event()
+    kwargs["output"] = False
+
+    def runCommand(command):
+        if cancel.is_set():
+            return None, ""
+        try:
+            return shellCmd(command, timeout=timeout, cancel=cancel,
+                            **kwargs)
+        except (OSError, ValueError) as error:
+            return None, str(error)
+
+    with ThreadPoolExecutor(workers or os.cpu_count()) as executor:
+        futures = {executor.submit(runCommand, command): index
+                   for index, command in enumerate(commands)}
+        finished = False
+        try:
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+            finished = True
+        finally:
+            if not finished:
+                cancel.set()
 
 
 def settingValue(setting):
     global settings
-    if setting in settings:
-        return settings[setting]
+    store = _settingsStore(setting)
+    if setting in store:
+        return store[setting]
     return None
 
 
+# Set the value of a setting and write the settings file if it changed. In
+# write-behind mode the write is deferred by settingsWriteDelay seconds on a
+# background thread, and any other changes made in that time are written with
+# it. Changes made with write=False are written with the next write.
 def setSetting(setting, value, write=True):
     global settings
-    if setting is not None:
-        if setting in settings and settings[setting] == value:
-            write = False
-        else:
-            settings[setting] = value
-    if write:
+    store = _settingsStore(setting)
+    with settingsLock:
+        if setting is not None:
+            if setting in store and store[setting] == value:
+                write = False
+            else:
+                store[setting] = value
+                settingsDirty.add(setting)
+        if not write:
+            return
+        settingsStats["requested"] += 1
+        if setting is None:
+            settingsDirty.add(None)
+        if settingsWriteDelay is not None:
+            _scheduleSettingsWrite()
+            return
+    flushSettings()
+
+
+def _scheduleSettingsWrite():
+    global settingsTimer
+    if settingsTimer is not None:
+        return
+    settingsTimer = threading.Timer(settingsWriteDelay, flushSettings)
+    settingsTimer.daemon = True
+    settingsTimer.start()
+
+
+# Turn write-behind mode on with the given delay in seconds, or off with None.
+# Turning it off writes any pending changes.
+def setSettingsWriteDelay(delay):
+    global settingsWriteDelay
+    settingsWriteDelay = delay
+    if delay is None:
+        flushSettings()
+
+
+# Turn journal mode on or off, optionally changing the journal size that
+# triggers compaction. Turning it off compacts the journals of the settings
+# files that are loaded.
+def setSettingsJournal(enabled, limit=None):
+    global settingsJournal, settingsJournalLimit
+    if limit is not None:
+        settingsJournalLimit = limit
+    settingsJournal = enabled
+    if not enabled:
         writeSettings()
 
 
-def readSettings(path=None):
-    global settings
-    if path is None:
-        path = currentDir() + "/settings.json"
-    settings = readJSON(file=path)
-    if not settings:
-        settings = dict()
-        return False
+# Turn shared mode on or off.
+def setSettingsShared(enabled):
+    global settingsShared
+    settingsShared = enabled
+
+
+# Set the serializer settings files are written with (see registerSerializer).
+# JSON settings files are still read when the serializer changes, so the
+# settings are kept, and each file is converted the next time it is written.
+# Pickled settings files are only read while the serializer is "pickle", since
+# loading a pickle can run any code.
+def setSettingsSerializer(serializer):
+    global settingsSerializer
+    _serializer(serializer)
+    settingsSerializer = serializer
+
+
+# Register a settings namespace. Settings with keys like "<namespace>.<name>"
+# are then kept in their own settings.<namespace>.json file next to the
+# settings file, which is only read the first time one of its settings is used
+# and only written when one of its settings changes. Any of its settings
+# already in the main settings file are moved to it when it is first loaded.
+def registerSettingsNamespace(namespace):
+    with settingsLock:
+        settingsNamespaces.setdefault(namespace, None)
+
+
+# Write any settings changes that haven't been written yet. Returns True if
+# anything was written. If another flush is writing, this waits for it first.
+def flushSettings():
+    global settingsTimer
+    with settingsFlushLock:
+        with settingsLock:
+            if settingsTimer is not None:
+                settingsTimer.cancel()
+                settingsTimer = None
+            if not settingsDirty:
+                return False
+            settingsStats["written"] += 1
+            changes = set(settingsDirty)
+            settingsDirty.clear()
+        _writeSettingsChanges(changes)
     return True
 
 
-def writeSettings(path=None):
-    global settings
+# Changes still waiting in write-behind mode are written at exit, after any
+# flush the timer thread is in the middle of, since that daemon thread is
+# stopped at exit.
+def _flushSettingsAtExit():
+    if settingsWriteDelay is not None:
+        flushSettings()
+
+
+# Return the number of settings writes requested, actually written, and
+# avoided by write-behind mode.
+def settingsWriteStats():
+    with settingsLock:
+        return settingsStats | {"avoided": settingsStats["requested"] -
+                                settingsStats["written"]}
+
+
+def _settingsPath(path=None):
     if path is None:
         path = currentDir() + "/settings.json"
-    writeJSON(obj=settings, file=path)
+    return path
+
+
+# Return the path of the settings file for a namespace, or of the main
+# settings file for None.
+def _settingsFilePath(namespace, path=None):
+    path = _settingsPath(path)
+    if namespace is None:
+        return path
+    base, extension = os.path.splitext(path)
+    return "{}.{}{}".format(base, namespace, extension)
 
 
-def importSettings(path, exportKeys):
+# Return the registered namespace a setting belongs to, or None for the main
+# settings.
+def _settingsNamespace(setting):
+    if not isinstance(setting, str) or "." not in setting:
+        return None
+    namespace = setting.split(".", 1)[0]
+    if namespace in settingsNamespaces:
+        return namespace
+    return None
+
+
+# Return the dictionary holding a setting, loading its namespace if needed,
+# and in shared mode re-reading it if its file changed. This must be called
+# without settingsLock held, since loading takes settingsWriteLock first.
+def _settingsStore(setting):
+    namespace = _settingsNamespace(setting)
+    if namespace is not None and settingsNamespaces[namespace] is None:
+        _loadSettingsNamespace(namespace)
+    elif settingsShared:
+        path = _settingsFilePath(namespace)
+        if settingsSignatures.get(path) != _settingsSignature(path):
+            with settingsWriteLock:
+                _mergeSettingsFile(namespace, path, ())
+    return _loadedSettingsStore(namespace)
+
+
+def _loadedSettingsStore(namespace):
+    if namespace is None:
+        return settings
+    return settingsNamespaces[namespace]
+
+
+def _loadSettingsNamespace(namespace):
+    path = _settingsFilePath(namespace)
+    with settingsWriteLock:
+        with settingsLock:
+            if settingsNamespaces[namespace] is not None:
+                return
+        signature = _settingsSignature(path)
+        store = _readSettingsFile(path)
+        with settingsLock:
+            prefix = namespace + "."
+            moved = {setting for setting in settings
+                     if isinstance(setting, str) and setting.startswith(prefix)}
+            for setting in moved:
+                store.setdefault(setting, settings.pop(setting))
+            settingsNamespaces[namespace] = store
+        settingsSignatures[path] = signature
+    if moved:
+        _writeSettingsFile(namespace, moved)
+        _writeSettingsFile(None, moved)
+
+
+# Return the signature of a settings file and its journal, which changes
+# whenever either is written.
+def _settingsSignature(path):
+    signature = []
+    for filePath in (path, path + settingsJournalSuffix):
+        try:
+            status = os.stat(filePath)
+        except OSError:
+            signature.append(None)
+            continue
+        signature.append((status.st_ino, status.st_mtime_ns, status.st_size))
+    return tuple(signature)
+
+
+# Hold the advisory lock for a settings file in shared mode.
+@contextmanager
+def _settingsFileLock(path):
+    if not settingsShared or fcntl is None:
+        yield
+        return
+    with open(path + ".lock", mode="a") as lockFile:
+        fcntl.flock(lockFile, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lockFile, fcntl.LOCK_UN)
+
+
+# In shared mode, if a loaded settings file changed on disk since it was last
+# read or written, read it again and merge it into the loaded settings. The
+# given changed settings, settings waiting to be written, and for None changes
+# every loaded setting, keep their loaded values. The caller must hold
+# settingsWriteLock.
+def _mergeSettingsFile(namespace, path, changes):
+    signature = _settingsSignature(path)
+    if not settingsShared or settingsSignatures.get(path) == signature:
+        return
+    data = _readSettingsFile(path)
+    with settingsLock:
+        store = _loadedSettingsStore(namespace)
+        keep = set(store) if changes is None else set(changes)
+        keep |= settingsDirty
+        for setting, value in data.items():
+            if setting not in keep:
+                store[setting] = value
+    settingsSignatures[path] = signature
+
+
+# Write the given changed settings. Each settings file with changes is
+# written, or in journal mode has the changes appended to its journal. A None
+# setting means all the settings should be written.
+def _writeSettingsChanges(changes):
+    if None in changes:
+        writeSettings()
+        return
+    namespaces = dict()
+    for setting in changes:
+        namespaces.setdefault(_settingsNamespace(setting), set()).add(setting)
+    for namespace, namespaceChanges in namespaces.items():
+        if settingsJournal:
+            _appendSettingsJournal(namespace, namespaceChanges)
+        else:
+            _writeSettingsFile(namespace, namespaceChanges)
+
+
+def _appendSettingsJournal(namespace, changes):
+    path = _settingsFilePath(namespace)
+    with settingsWriteLock, _settingsFileLock(path):
+        _mergeSettingsFile(namespace, path, changes)
+        with settingsLock:
+            store = _loadedSettingsStore(namespace)
+            records = [json.dumps({"setting": setting,
+                                   "value": store.get(setting)},
+                                  separators=(",", ":")) + "\n"
+                       for setting in changes]
+        with open(path + settingsJournalSuffix, mode="a",
+                  encoding="utf8") as journal:
+            journal.writelines(records)
+            journalSize = journal.tell()
+        settingsSignatures[path] = _settingsSignature(path)
+    if journalSize > settingsJournalLimit:
+        _writeSettingsFile(namespace, ())
+
+
+# Write a loaded settings file, first merging in changes made by other
+# processes in shared mode. If path is given, the settings are written next to
+# it instead, without merging.
+def _writeSettingsFile(namespace, changes=None, path=None):
+    filePath = _settingsFilePath(namespace, path)
+    with settingsWriteLock, _settingsFileLock(filePath):
+        if path is None:
+            _mergeSettingsFile(namespace, filePath, changes)
+        with settingsLock:
+            data = dict(_loadedSettingsStore(namespace))
+        _saveSettingsFile(data, filePath)
+        settingsSignatures[filePath] = _settingsSignature(filePath)
+
+
+# Write a settings file atomically, then remove its journal, since the file
+# now holds everything in it.
+def _saveSettingsFile(data, path):
+    writeJSON(obj=data, file=path, atomic=True, serializer=settingsSerializer)
+    deleteFile(path + settingsJournalSuffix)
+
+
+# Read a settings file, then replay any journal written in journal mode over
+# it. A partially written last journal record is ignored.
+def _readSettingsFile(path):
+    serializer = _settingsFileSerializer(path)
+    if serializer is None:
+        warn("{} is pickled, but the settings serializer is {}".format(
+            path, settingsSerializer), SyntaxWarning)
+        data = None
+    else:
+        data = readJSON(file=path, serializer=serializer)
+    if not isinstance(data, dict):
+        data = dict()
+    for record in readFile(path + settingsJournalSuffix, lines=True) or []:
+        try:
+            record = json.loads(record)
+        except json.JSONDecodeError:
+            break
+        data[record["setting"]] = record["value"]
+    return data
+
+
+# Return the serializer to read a settings file with. Files written by the
+# pickle serializer are recognised by their start, and other files are read
+# as JSON when settingsSerializer is "pickle". Pickled files are only loaded
+# when settingsSerializer is "pickle", and otherwise None is returned, so they
+# are treated as invalid.
+def _settingsFileSerializer(path):
+    try:
+        with _openFile(path, mode="rb") as settingsFile:
+            start = settingsFile.read(len(pickleMagic))
+    except OSError:
+        start = b""
+    if start == pickleMagic:
+        return "pickle" if settingsSerializer == "pickle" else None
+    return "stdlib" if settingsSerializer == "pickle" else settingsSerializer
+
+
+# Read the main settings file. Namespace settings files are read when first
+# used. If serializer is given, it is used for settings files from now on, as
+# if set by setSettingsSerializer.
+def readSettings(path=None, serializer=None):
+    global settings
+    if serializer is not None:
+        setSettingsSerializer(serializer)
+    path = _settingsPath(path)
+    signature = _settingsSignature(path)
+    newSettings = _readSettingsFile(path)
+    with settingsLock:
+        settings = newSettings
+        for namespace in settingsNamespaces:
+            settingsNamespaces[namespace] = None
+    settingsSignatures[path] = signature
+    return bool(settings)
+
+
+# Write the main settings file and the namespace settings files that are
+# loaded. Copies of the settings are taken so changes made on other threads
+# while writing are left for the next write. serializer works as it does for
+# readSettings.
+def writeSettings(path=None, serializer=None):
     global settings
-    newSettings = readJSON(file=path)
+    if serializer is not None:
+        setSettingsSerializer(serializer)
+    with settingsLock:
+        if path is None:
+            settingsDirty.clear()
+        namespaces = [None] + [namespace for namespace, store in
+                               settingsNamespaces.items() if store is not None]
+    for namespace in namespaces:
+        _writeSettingsFile(namespace, path=path)
+
+
+def importSettings(path, exportKeys, serializer="stdlib"):
+    global settings
+    newSettings = readJSON(file=path, serializer=serializer)
+    changes = set()
     for setting in exportKeys:
         if setting in newSettings:
-            settings[setting] = newSettings[setting]
-    writeSettings()
+            store = _settingsStore(setting)
+            with settingsLock:
+                store[setting] = newSettings[setting]
+            changes.add(setting)
+    _writeSettingsChanges(changes)
 
 
-def exportSettings(path, exportKeys):
+def exportSettings(path, exportKeys, serializer="stdlib"):
     global settings
     newSettings = dict()
     for setting in exportKeys:
         newSettings[setting] = settingValue(setting)
-    writeJSON(obj=newSettings, file=path)
+    writeJSON(obj=newSettings, file=path, serializer=serializer)
+
+
+atexit.register(_flushSettingsAtExit)